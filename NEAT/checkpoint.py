@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import hashlib
+import json
+import os
+import queue
+import threading
+import zipfile
+
+import numpy as np
+
+FORMAT = 1
+EXTENSION = '.npz'
+MANIFEST = 'manifest.json'
+STATS = 'stats.csv'
+
+def save_checkpoint(path, header, species, compress=False):
+    '''
+    write a population to path as a NumPy .npz of typed columns
+
+    header is a JSON-able dict of run settings (population, sizes, generation,
+    innovations...). Genes of every network are concatenated into one column
+    each and sliced by gene_offset, networks are sliced into species by
+    network_offset. Uncompressed checkpoints can be memory-mapped on load.
+    '''
+    write_columns(path, snapshot(header, species), compress)
+
+def snapshot(header, species, base_index=None):
+    '''
+    columns of a checkpoint, copies that stay valid while the population changes
+
+    For a delta checkpoint header['base'] names the full checkpoint it builds
+    on and base_index holds, per network, the index of the network with the
+    same genome in there or -1; only genomes not found are stored.
+    '''
+    networks = [network for sp in species for network in sp.networks()]
+    genomes = [network.genes() for network in networks]
+    keys = list(networks[0].mutation_rate()) if len(networks) > 0 else []
+
+    if base_index is not None:
+        genomes = [genome if i < 0 else genome.take(slice(0)) for genome, i in zip(genomes, base_index)]
+
+    def column(name, dtype):
+        return np.concatenate([getattr(genome, name)() for genome in genomes] + [np.zeros(0, dtype)])
+
+    header = dict(header, format=FORMAT, mutation_rate=keys)
+    columns = {
+        'header': np.frombuffer(json.dumps(header).encode(), dtype=np.uint8),
+
+        'species_max_fitness': _numbers([sp.max_fitness() for sp in species]),
+        'species_adjust_fitness': _numbers([sp.adjust_fitness() for sp in species]),
+        'species_stale_count': np.array([sp.stale_count() for sp in species], dtype=np.int32),
+        'network_offset': np.cumsum([0] + [sp.num_networks() for sp in species], dtype=np.int64),
+
+        'fitness': _numbers([network.fitness() for network in networks]),
+        'max_neurons': np.array([network.max_neurons() for network in networks], dtype=np.int32),
+        'ranking': np.array([network.ranking() for network in networks], dtype=np.int32),
+        'seed': np.array([-1 if network.seed() is None else network.seed() for network in networks], dtype=np.int64),
+        'mutation_rate': np.array([[network.mutation_rate()[key] for key in keys] for network in networks],
+                                  dtype=np.float64).reshape(len(networks), len(keys)),
+        'gene_offset': np.cumsum([0] + [len(genome) for genome in genomes], dtype=np.int64),
+
+        'into': column('into', np.int32),
+        'out': column('out', np.int32),
+        'w': column('w', np.float64),
+        'enable': column('enabled', bool),
+        'innovation': column('innovation', np.int32),
+    }
+
+    if base_index is not None:
+        columns['base_index'] = np.array(base_index, dtype=np.int64)
+
+    return columns
+
+def digest(genome):
+    '''hash of a genome's genes, equal genomes have equal digests'''
+    h = hashlib.md5()
+    for column in (genome.into(), genome.out(), genome.w(), genome.enabled(), genome.innovation()):
+        h.update(np.ascontiguousarray(column).tobytes())
+
+    return h.digest()
+
+def write_columns(path, columns, compress=False):
+    # written next to path and renamed, a checkpoint is never seen half written
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        (np.savez_compressed if compress else np.savez)(f, **columns)
+
+    os.replace(tmp, path)
+
+class CheckpointWriter:
+    '''
+    writes snapshots on a background thread
+
+    At most max_pending snapshots wait in the queue, submit() blocks once it
+    is full. A failed write is raised again by the next submit() or flush().
+    Pending checkpoints are flushed when the interpreter exits.
+    '''
+    def __init__(self, max_pending=2):
+        self._queue = queue.Queue(max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            job, args = self._queue.get()
+            try:
+                job(*args)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def submit(self, job, *args):
+        '''run job(*args) on the writer thread, after every job submitted before'''
+        self._raise()
+        self._queue.put((job, args))
+
+    def flush(self):
+        '''wait until every submitted checkpoint is on disk'''
+        self._queue.join()
+        self._raise()
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
+
+def _numbers(values):
+    # ints stay ints (fitness is a sum of integer rewards), anything else is float
+    return np.array(values, dtype=np.int64 if all(isinstance(v, int) for v in values) else np.float64)
+
+def read_columns(path, mmap=False):
+    '''
+    header dict and columns of a checkpoint; with mmap, columns of an
+    uncompressed checkpoint are read-only memory maps of the file
+    '''
+    columns = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')]
+            if mmap and info.compress_type == zipfile.ZIP_STORED:
+                columns[name] = _map_member(path, f, info)
+            else:
+                with archive.open(info) as member:
+                    columns[name] = np.lib.format.read_array(member)
+
+    header = json.loads(bytes(columns.pop('header')).decode())
+    return header, columns
+
+def _map_member(path, f, info):
+    # a stored zip member is the .npy file as is, after its local header
+    f.seek(info.header_offset + 26)
+    name_len, extra_len = np.frombuffer(f.read(4), dtype='<u2')
+    f.seek(info.header_offset + 30 + int(name_len) + int(extra_len))
+
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+
+    if int(np.prod(shape)) == 0:
+        return np.zeros(shape, dtype=dtype)
+
+    return np.memmap(path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                     order='F' if fortran else 'C')
+
+def load_checkpoint(path, mmap=False, lazy=False):
+    '''
+    header dict and the list of Species stored in a checkpoint
+
+    With lazy, a species builds its networks when they are first used and a
+    network decodes its genes when they are first used; together with mmap
+    only the parts of the file touched are ever read.
+    '''
+    header, c = read_columns(path, mmap)
+    base = None
+    if 'base_index' in c:
+        # genes of unchanged genomes are read from the full checkpoint
+        _, base = read_columns(os.path.join(os.path.dirname(path), header['base']), mmap)
+
+    genes = _Genes(c, base)
+    network_offset = c['network_offset'].tolist()
+
+    def networks(k):
+        return lambda: _networks(header, c, genes, network_offset[k], network_offset[k + 1], lazy)
+
+    species = []
+    for k, (max_fitness, adjust_fitness, stale_count) in enumerate(zip(
+            c['species_max_fitness'].tolist(),
+            c['species_adjust_fitness'].tolist(),
+            c['species_stale_count'].tolist())):
+        species.append(Species.restore(max_fitness, adjust_fitness, stale_count,
+                                       networks(k) if lazy else networks(k)()))
+
+    return header, species
+
+def _networks(header, c, genes, start, end, lazy):
+    keys = header['mutation_rate']
+    input, output = header['input_size'], header['output_size']
+
+    # checkpoints from before networks had seeds
+    seeds = c['seed'][start:end].tolist() if 'seed' in c else [-1] * (end - start)
+
+    networks = []
+    for i, fitness, mutation_rate, max_neurons, ranking, seed in zip(
+            range(start, end),
+            c['fitness'][start:end].tolist(),
+            c['mutation_rate'][start:end].tolist(),
+            c['max_neurons'][start:end].tolist(),
+            c['ranking'][start:end].tolist(),
+            seeds):
+        networks.append(Network.restore(input, output, genes.loader(i) if lazy else genes.genome(i), fitness,
+                                        dict(zip(keys, mutation_rate)), max_neurons, ranking,
+                                        None if seed < 0 else seed))
+
+    return networks
+
+class _Genes:
+    '''genomes of a checkpoint, those of a delta found in its full checkpoint are read from there'''
+    def __init__(self, columns, base=None):
+        self._columns = columns
+        self._base = base
+        self._base_index = columns.get('base_index')
+
+    def genome(self, i):
+        c = self._columns
+        if self._base_index is not None and self._base_index[i] >= 0:
+            c, i = self._base, int(self._base_index[i])
+
+        start, end = c['gene_offset'][i:i + 2].tolist()
+        return Genome.from_arrays(c['into'][start:end], c['out'][start:end], c['w'][start:end],
+                                  c['enable'][start:end], c['innovation'][start:end])
+
+    def loader(self, i):
+        return lambda: self.genome(i)
+
+class CheckpointManager:
+    '''keeps the checkpoints of a save directory, its manifest and stats log'''
+    def __init__(self, base, keep_last=0, keep_every=0, full_every=1, compress=False, writer=None):
+        self._base = base
+        self._keep_last = keep_last
+        self._keep_every = keep_every
+        self._full_every = max(1, full_every)
+        self._compress = compress
+        self._writer = writer
+        # every checkpoint kept and the full checkpoint it is a delta of, so
+        # resuming finds the newest one without scanning the directory
+        self._entries = self._read_manifest()
+        # generation and genome digests of the full checkpoint deltas refer to
+        self._full = None
+        self._full_index = {}
+        self._since_full = 0
+
+    def _read_manifest(self):
+        path = os.path.join(self._base, MANIFEST)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                return {int(gen): entry for gen, entry in json.loads(f.read())['checkpoints'].items()}
+
+        # older saves have no manifest, their directory is scanned once
+        entries = {}
+        if os.path.exists(self._base):
+            # binary checkpoints win over old JSON ones of the same generation
+            for f in sorted(os.listdir(self._base), key=lambda f: f.endswith(EXTENSION)):
+                name, ext = os.path.splitext(f)
+                if name.isdigit() and ext in ('.txt', EXTENSION):
+                    entries[int(name)] = {'file': f, 'base': None}
+
+        return entries
+
+    def compress(self):
+        return self._compress
+
+    def checkpoints(self):
+        '''generation -> path of every checkpoint kept, oldest first'''
+        return {gen: os.path.join(self._base, self._entries[gen]['file']) for gen in sorted(self._entries)}
+
+    def latest(self):
+        '''(generation, path) of the newest checkpoint, or None'''
+        if len(self._entries) == 0:
+            return None
+
+        gen = max(self._entries)
+        return gen, os.path.join(self._base, self._entries[gen]['file'])
+
+    def history(self):
+        '''
+        generation -> stats log row; generations only found in checkpoints
+        written before the log existed are added to it from their fitness
+        '''
+        self._flush()
+        path = os.path.join(self._base, STATS)
+        rows = read_stats(path)
+
+        # a checkpoint holds the elites of the generation before it
+        missing = []
+        for gen, checkpoint in self.checkpoints().items():
+            if gen - 1 not in rows and os.path.exists(checkpoint):
+                fitness = checkpoint_fitness(checkpoint)
+                if len(fitness) > 0:
+                    missing.append({'generation': gen - 1, 'max': max(fitness)})
+
+        if len(missing) > 0:
+            append_stats(path, missing)
+            rows.update((row['generation'], row) for row in missing)
+
+        return dict(sorted(rows.items()))
+
+    def _flush(self):
+        if self._writer is not None:
+            self._writer.flush()
+
+    def save(self, generation, header, species, stats=None):
+        '''checkpoint species as generation, stats is the row to log if any'''
+        networks = [network for sp in species for network in sp.networks()]
+        digests = [digest(network.genes()) for network in networks]
+        name = '{0}{1}'.format(generation, EXTENSION)
+
+        # every full_every-th save is full, the others only store the genomes
+        # not in the last full one
+        if self._full is None or self._since_full + 1 >= self._full_every:
+            columns = snapshot(header, species)
+            self._entries[generation] = {'file': name, 'base': None}
+            self._full = generation
+            self._full_index = {d: i for i, d in enumerate(digests)}
+            self._since_full = 0
+        else:
+            base = self._entries[self._full]['file']
+            columns = snapshot(dict(header, base=base), species, [self._full_index.get(d, -1) for d in digests])
+            self._entries[generation] = {'file': name, 'base': self._full}
+            self._since_full += 1
+
+        removed = [self._entries.pop(gen)['file'] for gen in self._expired()]
+        manifest = {'format': FORMAT, 'checkpoints': {str(gen): dict(entry) for gen, entry in self._entries.items()}}
+        args = (os.path.join(self._base, name), columns, manifest, removed, stats)
+
+        if self._writer is None:
+            self._write(*args)
+        else:
+            self._writer.submit(self._write, *args)
+
+    def _expired(self):
+        # with keep_last, only the last keep_last checkpoints, those of every
+        # keep_every-th generation and the full ones they need are kept
+        if self._keep_last <= 0:
+            return []
+
+        gens = sorted(self._entries)
+        kept = set(gens[-self._keep_last:])
+        if self._keep_every > 0:
+            kept.update(gen for gen in gens if gen % self._keep_every == 0)
+
+        # full checkpoints still needed by kept deltas, and the current one
+        kept.update(self._entries[gen]['base'] for gen in list(kept) if self._entries[gen]['base'] is not None)
+        kept.add(self._full)
+
+        return [gen for gen in gens if gen not in kept]
+
+    def _write(self, path, columns, manifest, removed, stats):
+        if not os.path.exists(self._base):
+            os.makedirs(self._base)
+
+        write_columns(path, columns, self._compress)
+        if stats is not None:
+            append_stats(os.path.join(self._base, STATS), [stats])
+
+        tmp = os.path.join(self._base, MANIFEST + '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(json.dumps(manifest).encode())
+        os.replace(tmp, os.path.join(self._base, MANIFEST))
+
+        # only forgotten by the manifest written above, safe to delete
+        for f in removed:
+            path = os.path.join(self._base, f)
+            if os.path.exists(path):
+                os.remove(path)
+
+from .gene import *
+from .network import *
+from .species import *
+from .stats import *
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+class EpisodeRace:
+    '''
+    fitness of count networks as the mean over `episodes` episodes each,
+    stopping the networks that can no longer be among the `elite` best
+    '''
+    def __init__(self, count, episodes, elite, bounds=(None, None), others=()):
+        self._episodes = episodes
+        self._elite = elite
+        # what one episode's fitness always lies within, either may be None
+        self._low, self._high = bounds
+        # fitness of networks not in the race an elite has to beat as well,
+        # e.g. the elites already carried over
+        self._others = np.asarray(others, dtype=np.float64)
+        self._sum = np.zeros(count)
+        self._played = np.zeros(count, dtype=np.int64)
+        self._stopped = np.zeros(count, dtype=bool)
+
+    def pending(self):
+        '''networks that still have episodes to play'''
+        return np.flatnonzero(~self._stopped & (self._played < self._episodes))
+
+    def played(self):
+        return self._played
+
+    def record(self, rows, fitness):
+        '''fitness of the next episode of each of rows'''
+        self._sum[rows] += fitness
+        self._played[rows] += 1
+        self._stop_hopeless()
+
+    def _stop_hopeless(self):
+        # a network's mean can only end up between (its sum + low per episode
+        # left) / episodes and the same with high; one whose highest possible
+        # mean is below the elite-th highest lowest possible one can not
+        # become an elite, it keeps the mean of what it played. Without a
+        # high bound every network plays every episode.
+        if self._high is None or len(self._sum) + len(self._others) <= self._elite:
+            return
+
+        left = np.where(self._stopped, 0, self._episodes - self._played)
+        # stopped networks are done, with the mean of what they played
+        done = np.where(self._stopped, self._sum / np.maximum(self._played, 1), self._sum / self._episodes)
+        if self._low is None:
+            lowest = np.where(left > 0, -np.inf, done)
+        else:
+            lowest = done + left * self._low / self._episodes
+        highest = done + left * self._high / self._episodes
+
+        threshold = np.partition(np.concatenate([lowest, self._others]), -self._elite)[-self._elite]
+        self._stopped |= (left > 0) & (highest < threshold)
+
+    def saved(self):
+        '''episodes the stopped networks did not play'''
+        return int((self._episodes - self._played)[self._stopped].sum())
+
+    def fitness(self):
+        '''mean fitness of the played episodes of every network, whole ones as ints'''
+        means = (self._sum / np.maximum(self._played, 1)).tolist()
+        return [int(m) if m.is_integer() else m for m in means]
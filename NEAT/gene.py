@@ -2,74 +2,180 @@
 
 import numpy as np
 
-class Gene:
-    def __init__(self, into, out, w, enable, innovation):
-        self._into = into
-        self._out = out
-        self._w = w
-        self._enable = enable
-        self._innovation = innovation
+class Genome:
+    '''
+    connection genes of a network stored as parallel arrays (into, out,
+    weight, enabled, innovation) in the order they were added
+
+    Arrays keep spare capacity so adding a gene is amortized O(1); the
+    accessors return views of the used part.
+    '''
+    def __init__(self, capacity=0):
+        self._size = 0
+        self._into = np.zeros(capacity, dtype=np.int32)
+        self._out = np.zeros(capacity, dtype=np.int32)
+        self._w = np.zeros(capacity, dtype=np.float64)
+        self._enable = np.zeros(capacity, dtype=bool)
+        self._innovation = np.zeros(capacity, dtype=np.int32)
 
     @staticmethod
-    def from_json(obj):
-        return Gene(
-            obj['into'],
-            obj['out'],
-            obj['w'],
-            obj['enable'],
-            obj['innovation']
-        )
+    def from_arrays(into, out, w, enable, innovation):
+        genome = Genome(len(into))
+        genome._size = len(into)
+        genome._into[:] = into
+        genome._out[:] = out
+        genome._w[:] = w
+        genome._enable[:] = enable
+        genome._innovation[:] = innovation
 
-    def to_json(self):
-        return {
-            'into': self._into,
-            'out': self._out,
-            'w': self._w,
-            'enable': self._enable,
-            'innovation': self._innovation,
-        }
+        return genome
 
     @staticmethod
-    def create(into, out):
-        return Gene(into, out, np.random.rand() * 4 - 2, True, Neat.new_innovation())
+    def from_json(obj):
+        return Genome.from_arrays(
+            [gene['into'] for gene in obj],
+            [gene['out'] for gene in obj],
+            [gene['w'] for gene in obj],
+            [gene['enable'] for gene in obj],
+            [gene['innovation'] for gene in obj]
+        )
 
     @staticmethod
-    def copy(src, new=True):
-        if new:
-            gene = Gene(src._into, src._out, src._w, src._enable, Neat.new_innovation())
-        else:
-            gene = Gene(src._into, src._out, src._w, src._enable, src.innovation())
+    def concatenate(genomes):
+        '''one genome with the genes of all genomes, and the index of the genome each gene came from'''
+        lengths = [len(genome) for genome in genomes]
+        genome = Genome.from_arrays(*[
+            np.concatenate([getattr(other, column)() for other in genomes] + [np.zeros(0, dtype)])
+            for column, dtype in (('into', np.int32), ('out', np.int32), ('w', np.float64),
+                                  ('enabled', bool), ('innovation', np.int32))
+        ])
 
-        return gene
+        return genome, np.repeat(np.arange(len(genomes), dtype=np.int64), lengths)
 
-    def w(self):
-        return self._w
+    def to_json(self):
+        return [{
+            'into': into,
+            'out': out,
+            'w': w,
+            'enable': enable,
+            'innovation': innovation,
+        } for into, out, w, enable, innovation in zip(
+            self.into().tolist(),
+            self.out().tolist(),
+            self.w().tolist(),
+            self.enabled().tolist(),
+            self.innovation().tolist()
+        )]
+
+    def copy(self):
+        return self.take(slice(None))
+
+    def take(self, index):
+        '''new genome made of the genes selected by a mask, indices or slice'''
+        return Genome.from_arrays(
+            self.into()[index],
+            self.out()[index],
+            self.w()[index],
+            self.enabled()[index],
+            self.innovation()[index]
+        )
 
-    def set_w(self, w):
-        self._w = w
+    def _grow(self, size):
+        capacity = max(size, 2 * len(self._w), 8)
+        for name in ('_into', '_out', '_w', '_enable', '_innovation'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def add(self, into, out, w, enable, innovation):
+        if self._size == len(self._w):
+            self._grow(self._size + 1)
+
+        i = self._size
+        self._into[i] = into
+        self._out[i] = out
+        self._w[i] = w
+        self._enable[i] = enable
+        self._innovation[i] = innovation
+        self._size += 1
+
+        return i
+
+    def extend(self, other, index=slice(None)):
+        '''append the genes of other selected by index'''
+        into = other.into()[index]
+        n = self._size + len(into)
+        if n > len(self._w):
+            self._grow(n)
+
+        self._into[self._size:n] = into
+        self._out[self._size:n] = other.out()[index]
+        self._w[self._size:n] = other.w()[index]
+        self._enable[self._size:n] = other.enabled()[index]
+        self._innovation[self._size:n] = other.innovation()[index]
+        self._size = n
 
     def into(self):
-        return self._into
-
-    def set_into(self, into):
-        self._into = into
+        return self._into[:self._size]
 
     def out(self):
-        return self._out
+        return self._out[:self._size]
 
-    def set_out(self, out):
-        self._out = out
+    def w(self):
+        return self._w[:self._size]
 
     def enabled(self):
-        return self._enable
+        return self._enable[:self._size]
+
+    def innovation(self):
+        return self._innovation[:self._size]
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._size
 
-    def set_enable(self, enable):
-        self._enable = enable
+        if not 0 <= i < self._size:
+            raise IndexError(i)
+
+        return Gene(self, i)
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield Gene(self, i)
+
+class Gene:
+    '''a single gene of a Genome, read from the genome's arrays'''
+    def __init__(self, genome, index):
+        self._genome = genome
+        self._index = index
+
+    def to_json(self):
+        return {
+            'into': self.into(),
+            'out': self.out(),
+            'w': self.w(),
+            'enable': self.enabled(),
+            'innovation': self.innovation(),
+        }
+
+    def w(self):
+        return float(self._genome._w[self._index])
+
+    def into(self):
+        return int(self._genome._into[self._index])
+
+    def out(self):
+        return int(self._genome._out[self._index])
+
+    def enabled(self):
+        return bool(self._genome._enable[self._index])
 
     def innovation(self):
-        return self._innovation
+        return int(self._genome._innovation[self._index])
 
     def link(self):
-        return (self._into, self._out)
-
-from .neat import *
+        return (self.into(), self.out())
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import numpy as np
+
+LINK = 'link'
+SPLIT = 'split'
+
+class InnovationRegistry:
+    '''
+    hands out innovation numbers and hidden neuron ids
+
+    Structural mutations are keyed by (into, out, kind): a new link between
+    two neurons, or a new neuron splitting a link. The same mutation made by
+    several networks within one generation gets the same numbers, so their
+    genes stay comparable for distance and crossover. The table is cleared by
+    next_generation(), the counters are kept for the whole run.
+
+    A registry is thread safe. For worker processes, fork() a provisional
+    registry that numbers mutations with negative placeholders and merge()
+    the mutated networks back, which renumbers them through this registry.
+    '''
+    def __init__(self, innovation=0, neuron=0, provisional=False):
+        self._innovation = innovation
+        self._neuron = neuron
+        self._provisional = provisional
+        self._table = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def from_json(obj):
+        registry = InnovationRegistry(obj['innovation'], obj['neuron'])
+        for into, out, kind, value in obj['table']:
+            registry._table[(into, out, kind)] = tuple(value)
+
+        return registry
+
+    def to_json(self):
+        return {
+            'innovation': self._innovation,
+            'neuron': self._neuron,
+            'table': [[into, out, kind, list(value)] for (into, out, kind), value in self._table.items()],
+        }
+
+    @staticmethod
+    def from_networks(networks, input, output):
+        '''registry continuing after the numbers already used by networks'''
+        innovation = 0
+        neuron = input + output
+
+        for network in networks:
+            if len(network.genes()) > 0:
+                innovation = max(innovation, int(network.genes().innovation().max()))
+
+            neuron = max(neuron, network.max_neurons())
+
+        return InnovationRegistry(innovation, neuron)
+
+    def _next(self, count):
+        step = -1 if self._provisional else 1
+        numbers = []
+        for _ in range(count):
+            self._innovation += step
+            numbers.append(self._innovation)
+
+        return numbers
+
+    def _next_neuron(self):
+        self._neuron += -1 if self._provisional else 1
+        return self._neuron
+
+    def link(self, into, out):
+        '''innovation number of a new gene from into to out'''
+        with self._lock:
+            key = (into, out, LINK)
+            if key not in self._table:
+                self._table[key] = tuple(self._next(1))
+
+            return self._table[key][0]
+
+    def split(self, into, out):
+        '''(neuron, innovation into -> neuron, innovation neuron -> out) of a new neuron on a link'''
+        with self._lock:
+            key = (into, out, SPLIT)
+            if key not in self._table:
+                self._table[key] = (self._next_neuron(), *self._next(2))
+
+            return self._table[key]
+
+    def next_generation(self):
+        with self._lock:
+            self._table = {}
+
+    def innovation(self):
+        return self._innovation
+
+    def neuron(self):
+        return self._neuron
+
+    def fork(self):
+        return InnovationRegistry(provisional=True)
+
+    def merge(self, local, networks):
+        '''renumber networks mutated with the forked registry local'''
+        innovations = {}
+        neurons = {}
+
+        for (into, out, kind), value in local._table.items():
+            if kind == LINK:
+                innovations[value[0]] = self.link(into, out)
+            else:
+                neuron, inn1, inn2 = self.split(into, out)
+                neurons[value[0]] = neuron
+                innovations[value[1]] = inn1
+                innovations[value[2]] = inn2
+
+        innovation_map = _placeholder_map(innovations)
+        neuron_map = _placeholder_map(neurons)
+
+        for network in networks:
+            genes = network.genes()
+            inn = genes.innovation()
+            inn[:] = np.where(inn < 0, innovation_map[-np.minimum(inn, 0)], inn)
+
+            for column in (genes.into(), genes.out()):
+                column[:] = np.where(column < 0, neuron_map[-np.minimum(column, 0)], column)
+
+            if len(genes) > 0:
+                highest = max(int(genes.into().max()), int(genes.out().max()))
+                network.set_max_neurons(max(network.max_neurons(), highest))
+
+            network.invalidate()
+
+def _placeholder_map(numbers):
+    # index -p holds the number for placeholder p
+    table = np.zeros(1 + max([-p for p in numbers] + [0]), dtype=np.int64)
+    for p, n in numbers.items():
+        table[-p] = n
+
+    return table
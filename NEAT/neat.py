@@ -2,12 +2,18 @@
 
 import json
 import math
-import os
 
-class Neat:
-    innovation = 0
+ELITIST = 'elitist'
+SPECIES = 'species'
+
+# networks carried over unchanged by ELITIST, and what early stopped episodes compete for
+ELITE = 3
 
-    def __init__(self, population=50, input_size=400, output_size=4, save_path='./save'):
+class Neat:
+    def __init__(self, population=50, input_size=400, output_size=4, save_path='./save', compress=False,
+                 background_save=True, keep_last=0, keep_every=0, full_every=10, seed=None,
+                 selection='roulette', parallel_offspring=False, reproduction=ELITIST,
+                 episodes=1, episode_bounds=(None, None), encoder=None):
         #self.pool = Pool(population)
         self._population = population
         self._species = []
@@ -18,109 +24,167 @@ class Neat:
         self._output_size = output_size
         self._network_cache = None
         self._save_path = save_path
+        self._writer = CheckpointWriter() if background_save else None
+        self._checkpoints = CheckpointManager(save_path, keep_last, keep_every, full_every, compress, self._writer)
+        self._pool = None
+        self._workers = 1
+        self._streams = RandomStreams(seed)
+        self._rng = self._streams.main()
+        self._registry = InnovationRegistry(0, input_size + output_size)
+        # add_species_all() calls this generation, orders the species to try
+        self._matches = 0
+        # ELITIST or SPECIES, see _reproduce_elitist and _reproduce_species
+        self._reproduction = reproduction
+        # a name in selection.SCHEMES or a function(fitness, count, rng), for ELITIST
+        self._selection = selection
+        # breed children on the evaluation pool when there is one
+        self._parallel_offspring = parallel_offspring
+        # episodes played by every network, their bounds for EpisodeRace
+        self._episodes = episodes
+        self._episode_bounds = episode_bounds
+        self._episode_seeds = []
+        # JSON-able description of what makes the inputs, kept in checkpoints
+        # so the networks can be played on the same inputs they learned on
+        self._encoder = encoder
 
     def init(self):
+        networks = []
         for _ in range(self._population):
-            network = Network.create_basic(self._input_size, self._output_size)
-            network.mutate()
-            self.add_species(network)
+            networks.append(Network.create_basic(self._input_size, self._output_size))
+
+        self._seed_networks(networks)
+        Network.mutate_all(networks, self._rng, self._registry)
+        self.add_species_all(networks)
+        self._episode_seeds = self.seeds(self._episodes)
 
         self._network_cache = self._species[0].network(0)
         self._network_cache.generate()
 
     def get_graph(self):
-        base = self._save_path
-        if not os.path.exists(base):
+        history = self._checkpoints.history()
+        if len(history) == 0:
             return
 
         with open('graph.csv', 'wb') as f_g:
-            for _, _, file in os.walk(base):
-                for f in file:
-                    gen = int(f.split('.')[0])
-                    path = os.path.join(base, f)
-
-                    data = open(path, 'rb').read()
-                    obj = json.loads(data)
-                    species = []
-                    for sp in obj['species']:
-                        species.append(Species.from_json(sp))
-
-                    max_fitness = -2000
-                    for sp in species:
-                        for nw in sp.networks():
-                            if nw.fitness() > max_fitness:
-                                max_fitness = nw.fitness()
-
-                    f_g.write('{0},{1}\n'.format(gen, max_fitness).encode())
-
+            for gen, row in history.items():
+                f_g.write('{0},{1}\n'.format(gen, _plain(row['max'])).encode())
 
     def load(self):
-        base = self._save_path
-        if not os.path.exists(base):
+        self.flush()
+        latest = self._checkpoints.latest()
+        if latest is None:
             self.init()
             return
 
-        max_gen = 0
-        for _, _, file in os.walk(base):
-            for f in file:
-                gen = int(f.split('.')[0])
-                if gen > max_gen:
-                    max_gen = gen
-
-        path = os.path.join(base, '{0}.txt'.format(max_gen))
+        max_gen, path = latest
         print('loading', path)
 
-        with open(path, 'rb') as f:
-            obj = json.loads(f.read())
-            self._population = obj['population']
-            self._input_size = obj['input_size']
-            self._output_size = obj['output_size']
-            self._generation = max_gen
-
-            for species in obj['species']:
-                self._species.append(Species.from_json(species))
-
+        if path.endswith(EXTENSION):
+            obj, self._species = load_checkpoint(path, mmap=True, lazy=True)
+        else:
+            with open(path, 'rb') as f:
+                obj = json.loads(f.read())
+                self._species = [Species.from_json(species) for species in obj['species']]
+
+        self._population = obj['population']
+        self._input_size = obj['input_size']
+        self._output_size = obj['output_size']
+        # None for older saves, which did not record it
+        self._encoder = obj.get('encoder')
+        self._generation = max_gen
+
+        # older saves did not keep the innovation counter
+        if 'innovations' in obj:
+            self._registry = InnovationRegistry.from_json(obj['innovations'])
+        else:
+            self._registry = InnovationRegistry.from_networks(self.networks(), self._input_size, self._output_size)
+
+        # nor the random streams, those go on from the seed given to __init__
+        if 'random' in obj:
+            self._streams = RandomStreams.from_json(obj['random'])
+            self._rng = self._streams.main()
+
+        # nor the games of the generation, or as many as now asked for
+        if len(obj.get('episodes', [])) == self._episodes:
+            self._episode_seeds = obj['episodes']
+        else:
+            self._episode_seeds = self.seeds(self._episodes)
+
+        # the elites carried over already have their fitness
         self._network_cache = self._species[0].network(0)
-        self._network_cache.generate()
-
-    def save(self, base):
-        if not os.path.exists(base):
-            os.makedirs(base)
-
-        path = os.path.join(base, '{0}.txt'.format(self._generation))
-
-        with open(path, 'wb') as f:
-            obj = {
-                'population': self._population,
-                'species': [],
-                'input_size': self._input_size,
-                'output_size': self._output_size,
-            }
-
-            for species in self._species:
-                obj['species'].append(species.to_json())
-
-            f.write(json.dumps(obj).encode())
+        self.next()
+
+    def save(self, base, stats=None):
+        checkpoints = self._checkpoints
+        if base != self._save_path:
+            checkpoints = CheckpointManager(base, compress=self._checkpoints.compress(), writer=self._writer)
+
+        header = {
+            'population': self._population,
+            'generation': self._generation,
+            'input_size': self._input_size,
+            'output_size': self._output_size,
+            'innovations': self._registry.to_json(),
+            'random': self._streams.to_json(),
+            'episodes': self._episode_seeds,
+            'encoder': self._encoder,
+        }
+
+        checkpoints.save(self._generation, header, self._species, stats)
+
+    def flush(self):
+        '''wait for checkpoints still being written in the background'''
+        if self._writer is not None:
+            self._writer.flush()
 
     def add_species(self, network):
-        for species in self._species:
-            existing_network = species.fetch_random_network()
-            if existing_network is not None and is_same_species(network, existing_network):
-                species.add_network(network)
-                return
-
-        # could not find one, create new
-        species = Species()
-        species.add_network(network)
-        self._species.append(species)
+        self.add_species_all([network])
+
+    def add_species_all(self, networks):
+        '''
+        put every network in the first species whose representative is close
+        enough, trying the species that took networks most recently first and
+        the larger ones first among those; networks fitting none found new
+        species in order
+        '''
+        self._matches += 1
+        order = sorted(self._species, key=lambda species: (-species.matched(), -species.num_networks()))
+        order = [species for species in order if species.representative() is not None]
+
+        matches = assign(networks, [species.representative() for species in order]).tolist()
+        for network, match in zip(networks, matches):
+            if match >= 0:
+                order[match].add_network(network)
+                order[match].set_matched(self._matches)
+
+        # could not find one, create new ones
+        rest = [network for network, match in zip(networks, matches) if match < 0]
+        created = {}
+        for i, (network, founder) in enumerate(zip(rest, founders(rest).tolist())):
+            if founder == i:
+                created[i] = Species()
+                created[i].set_matched(self._matches)
+                self._species.append(created[i])
+
+            created[founder].add_network(network)
+
+    def _species_fitness(self):
+        '''fitness of every network, species after species, and where each species starts'''
+        fitness = np.array([network.fitness() for species in self._species for network in species.networks()],
+                           dtype=np.float64)
+        offsets = np.cumsum([0] + [species.num_networks() for species in self._species[:-1]])
+
+        return fitness, offsets
 
     def _remove_stale_species(self):
         if len(self._species) < 2:
             return
 
+        fitness, offsets = self._species_fitness()
+        max_fitness_now = np.maximum.reduceat(fitness, offsets).tolist()
+
         survived = []
-        for species in self._species:
-            mfn = species.max_fitness_now()
+        for species, mfn in zip(self._species, max_fitness_now):
             if species.max_fitness() < mfn:
                 species.set_max_fitness(mfn)
             else:
@@ -130,49 +194,51 @@ class Neat:
 
             survived.append(species)
 
+        # all stale at once, e.g. on a long plateau: keep the best one
+        if len(survived) == 0:
+            survived.append(self._species[int(np.argmax(max_fitness_now))])
+
         self._species = survived
 
     def _global_ranking(self):
-        ranking = {}
-
-        for species in self._species:
-            for network in species.networks():
-                ranking[network] = network.fitness()
-
-        ranking = sorted(ranking, key=ranking.get)
+        networks = [network for species in self._species for network in species.networks()]
+        order = np.argsort([network.fitness() for network in networks], kind='stable')
 
-        rank = 1
-        for network in ranking:
-            network.set_ranking(rank)
-            rank += 1
+        for rank, i in enumerate(order.tolist(), 1):
+            networks[i].set_ranking(rank)
 
     def _total_adjust_fitness(self):
-        total_adjust_fitness = 0.0
-        minimum = 0.0
+        fitness, offsets = self._species_fitness()
+        counts = np.diff(np.append(offsets, len(fitness)))
+        adjust_fitness = np.add.reduceat(fitness, offsets) / counts
 
-        for species in self._species:
-            adjust_fitness = species.calculate_adjust_fitness()
-
-            if adjust_fitness < minimum:
-                minimum = adjust_fitness
-
-            total_adjust_fitness += adjust_fitness
+        for species, adjust in zip(self._species, adjust_fitness.tolist()):
+            species.set_adjust_fitness(adjust)
 
-        if minimum < 0.0:
-            total_adjust_fitness += abs(minimum) * len(self._species)
+        minimum = min(0.0, float(adjust_fitness.min()))
+        total_adjust_fitness = float(adjust_fitness.sum()) + abs(minimum) * len(self._species)
 
         return total_adjust_fitness, minimum
 
-    def _remove_weak_species(self):
-        survived = []
+    def _offspring_shares(self):
+        '''share of the population each species breeds, from its shifted adjusted fitness'''
         total_adjust_fitness, minimum = self._total_adjust_fitness()
+        adjust_fitness = np.array([species.adjust_fitness() for species in self._species])
 
-        for species in self._species:
-            if math.floor((species.adjust_fitness() + abs(minimum)) / total_adjust_fitness * self._population) >= 1:
-                survived.append(species)
+        # no species does better than any other
+        if not total_adjust_fitness > 0:
+            return np.full(len(self._species), 1 / len(self._species))
+
+        return (adjust_fitness + abs(minimum)) / total_adjust_fitness
+
+    def _remove_weak_species(self):
+        shares = self._offspring_shares()
+        survived = [species for species, share in zip(self._species, shares.tolist())
+                    if math.floor(share * self._population) >= 1]
 
         #print('{} / {} survived'.format(len(survived), len(self._species)))
-        self._species = survived
+        if len(survived) > 0:
+            self._species = survived
 
     def _respeciate(self):
         unordered = []
@@ -200,80 +266,85 @@ class Neat:
 
         return networks
 
-    def _rullet(self, networks, minimum):
-        minimum = abs(minimum)
-        fitness_sum = sum(map(Network.fitness, networks)) + (minimum * len(networks))
+    def next_generation(self):
+        stats = generation_stats(self._generation, self._species)
+        self._registry.next_generation()
 
-        r = np.random.randint(fitness_sum)
-        s = 0
+        self._matches = 0
+        for species in self._species:
+            species.set_matched(0)
 
-        for network in networks:
-            s += network.fitness() + minimum
-            if s > r:
-                return network
+        if self._reproduction == SPECIES:
+            self._reproduce_species()
+        else:
+            self._reproduce_elitist()
 
-        return networks[0]
+        #print(self._total_networks(), list(map(Species.num_networks, self._species)))
 
-    def next_generation(self):
-        networks = self._unspeciate()
+        self._episode_seeds = self.seeds(self._episodes)
+        self._current_network = 0
+        self._generation += 1
 
-        # copy top 3 networks without any mutation
-        elite = 3
+        self.save(self._save_path, stats)
 
+    def _reproduce_elitist(self):
+        '''the best networks survive, the rest are children of parents picked from the whole population'''
+        networks = self._unspeciate()
+
+        # copy top networks without any mutation
         ranking = sorted(networks, key=Network.fitness, reverse=True)
         #print(list(map(Network.fitness, ranking)))
 
-        for i in range(elite):
-            self.add_species(ranking[i])
-
-        for _ in range(self._population - elite):
-            mom = self._rullet(ranking, ranking[-1].fitness())
-            dad = self._rullet(ranking, ranking[-1].fitness())
-
-            child = Network.crossover(mom, dad)
-            child.mutate()
-            #next_networks.append(child)
-            self.add_species(child)
-
-        #self._global_ranking()
-
-        # for species in self._species:
-        #     # remove lowest performing members
-        #     species.remove_lower(species.num_networks() // 2)
-        #
-        # self._remove_stale_species()
-        # self._remove_weak_species()
-        # #self._global_ranking()
-        #
-        # # now no species have negative average fitness
-        # total_adjust_fitness, minimum = self._total_adjust_fitness()
-        #
-        # children = []
-        # for species in self._species:
-        #     n_children = math.floor((species.adjust_fitness() + abs(minimum)) / total_adjust_fitness * self._population) - 1
-        #
-        #     if n_children > 0:
-        #         for _ in range(n_children):
-        #             children.append(species.make_child())
-        #
-        #     species.remove_lower(1)
-        #
-        # rest = self._population - len(self._species) - len(children)
-        # if rest > 0:
-        #     for _ in range(rest):
-        #         ns = len(self._species)
-        #         species = self._species[np.random.randint(ns) if ns > 1 else 0]
-        #         children.append(species.make_child())
-        #
-        # for child in children:
-        #     self.add_species(child)
-        #
-        #print(self._total_networks(), list(map(Species.num_networks, self._species)))
+        self.add_species_all(ranking[:ELITE])
 
-        self._current_network = 0
-        self._generation += 1
+        fitness = [network.fitness() for network in ranking]
+        parents = select_parents(self._selection, fitness, self._population - ELITE, self._rng)
+
+        children = self._breed([ranking[mom] for mom in parents[:, 0]], [ranking[dad] for dad in parents[:, 1]])
+        self._seed_networks(children)
+        self.add_species_all(children)
+
+    def _reproduce_species(self):
+        '''
+        NEAT with fitness sharing: every species keeps its best network and
+        breeds children in proportion to its average fitness
+        '''
+        self._global_ranking()
+
+        for species in self._species:
+            # remove lowest performing members
+            species.remove_lower(species.num_networks() // 2)
+
+        self._remove_stale_species()
+        self._remove_weak_species()
+
+        # now no species have negative average fitness
+        shares = self._offspring_shares()
+
+        moms, dads = [], []
+        for species, share in zip(self._species, shares.tolist()):
+            n_children = math.floor(share * self._population) - 1
+
+            if n_children > 0:
+                for mom, dad in species.pick_parents(n_children, self._rng):
+                    moms.append(mom)
+                    dads.append(dad)
+
+            species.remove_lower(1)
+            species.choose_representative()
 
-        self.save(self._save_path)
+        rest = self._population - len(self._species) - len(moms)
+        if rest > 0:
+            ns = len(self._species)
+            picks = self._rng.integers(ns, size=rest) if ns > 1 else np.zeros(rest, dtype=np.int64)
+            for k, count in enumerate(np.bincount(picks, minlength=ns).tolist()):
+                for mom, dad in self._species[k].pick_parents(count, self._rng):
+                    moms.append(mom)
+                    dads.append(dad)
+
+        children = self._breed(moms, dads)
+        self._seed_networks(children)
+        self.add_species_all(children)
 
     def _next(self):
         self._current_network += 1
@@ -296,20 +367,135 @@ class Neat:
         self._network_cache.generate()
         #self._network_cache.to_string()
 
+    def _breed(self, moms, dads):
+        '''Network.breed_all() of (mom, dad) pairs, on the pool if asked to'''
+        if self._parallel_offspring and self._pool is not None:
+            return breed_networks(moms, dads, self.seeds(math.ceil(len(moms) / BREED_CHUNK)), self._registry, self._pool)
+
+        return Network.breed_all(moms, dads, self._rng, self._registry)
+
+    def _seed_networks(self, networks):
+        for network, seed in zip(networks, self._streams.seeds(len(networks))):
+            network.set_seed(seed)
+
+    def seeds(self, n):
+        '''n seeds of independent streams, e.g. for the games of n networks'''
+        return self._streams.seeds(n)
+
+    def networks(self):
+        networks = []
+        for species in self._species:
+            networks += species.networks()
+
+        return networks
+
+    def population_evaluator(self, networks=None):
+        '''build every network (all by default) and pack them for batched evaluation'''
+        if networks is None:
+            networks = self.networks()
+
+        for network in networks:
+            network.generate()
+
+        return PopulationEvaluator(networks)
+
+    def end_generation(self):
+        '''move on once every network got its fitness outside of next()'''
+        self._current_species = 0
+        self.next_generation()
+
+        self._network_cache = self._species[0].network(0)
+        self._network_cache.generate()
+
+    def play_episodes(self, play, networks=None):
+        '''
+        give networks (every one without a fitness yet by default) the mean
+        fitness of their episodes, stopping early the ones that can not
+        become elites (see EpisodeRace); returns how many episodes that saved
+
+        Only ELITIST reproduction stops networks early: SPECIES breeds from
+        the fitness of every member, which has to be the full mean.
+
+        play(networks, seeds) returns the fitness of one episode of each of
+        networks, networks[i] playing on seeds[i]. The k-th episode of every
+        network is played on the k-th seed of the generation, so all networks
+        are compared on the same games.
+        '''
+        if networks is None:
+            networks = [network for network in self.networks() if network.fitness() == 0]
+
+        seeds = np.array([self._episode_seeds] * len(networks), dtype=np.int64).reshape(-1, self._episodes)
+        bounds = self._episode_bounds if self._reproduction == ELITIST else (self._episode_bounds[0], None)
+        saved = 0
+
+        # like next(), networks that ended on exactly 0 play again, on new games
+        while len(networks) > 0:
+            playing = set(map(id, networks))
+            others = [network.fitness() for network in self.networks()
+                      if id(network) not in playing and network.fitness() != 0]
+            race = EpisodeRace(len(networks), self._episodes, ELITE, bounds, others)
+
+            rows = race.pending()
+            while len(rows) > 0:
+                fitness = play([networks[i] for i in rows.tolist()], seeds[rows, race.played()[rows]].tolist())
+                race.record(rows, fitness)
+                rows = race.pending()
+
+            for network, fitness in zip(networks, race.fitness()):
+                network.add_fitness(fitness)
+
+            saved += race.saved()
+            networks = [network for network in networks if network.fitness() == 0]
+            seeds = np.array(self.seeds(len(networks) * self._episodes), dtype=np.int64).reshape(-1, self._episodes)
+
+        return saved
+
+    def evaluate_generation(self, fitness_fn, workers=1):
+        '''
+        evaluate every network without a fitness yet with fitness_fn(network,
+        seed) on `workers` processes, one call per episode, then move on to
+        the next generation
+        '''
+        if workers > 1 and (self._pool is None or self._workers != workers):
+            self.close()
+            self._pool = create_pool(workers)
+            self._workers = workers
+
+        pool = self._pool if workers > 1 else None
+        self.play_episodes(lambda networks, seeds: evaluate_networks(fitness_fn, networks, seeds, pool, workers))
+
+        self.end_generation()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+        self.flush()
+
     def generation(self):
         return self._generation
 
+    def input_size(self):
+        return self._input_size
+
+    def encoder(self):
+        return self._encoder
+
+    def network(self):
+        '''the network next() stopped at'''
+        return self._network_cache
+
+    def episode_seeds(self):
+        return self._episode_seeds
+
     def current_species(self):
         return self._current_species
 
     def current_network(self):
         return self._current_network
 
-    @staticmethod
-    def new_innovation():
-        Neat.innovation += 1
-        return Neat.innovation
-
     def evaluate(self, input):
         #species = self._species[self._current_species]
         #network = species.network(self._current_network)
@@ -323,6 +509,18 @@ class Neat:
     def fitness(self):
         return self._network_cache.fitness()
 
+def _plain(value):
+    # fitness read back from the log is a float, print whole numbers as ints
+    return int(value) if float(value).is_integer() else value
+
+from .batch import *
+from .checkpoint import *
+from .episodes import EpisodeRace
+from .innovation import *
 from .network import *
+from .parallel import *
+from .selection import select_parents
 from .species import *
-from .util import is_same_species
+from .streams import *
+from .stats import generation_stats
+from .util import assign, founders
@@ -1,67 +1,15 @@
 # -*- coding: utf-8 -*-
 
-from copy import deepcopy
 import numpy as np
 
-class Neuron:
-    def __init__(self):
-        self._value = 0.0
-        self._resolved = False
-        self._bias = np.random.rand() - 0.5
-        self._incoming = []
-
-    @staticmethod
-    def from_json(obj):
-        neuron = Neuron()
-        neuron._value = obj['value']
-        neuron._resolved = obj['resolved']
-        neuron._bias = obj['bias']
-
-        for gene in obj['incoming']:
-            neuron._incoming.append(Gene.from_json(gene))
-
-        return neuron
-
-    def to_json(self):
-        obj = {
-            'value': self._value,
-            'resolved': self._resolved,
-            'bias': self._bias,
-            'incoming': [],
-        }
-
-        for gene in self._incoming:
-            obj['incoming'].append(gene.to_json())
-
-        return obj
-
-    def reset(self):
-        self._value = 0.0
-        self._resolved = False
-
-    def bias(self):
-        return self._bias
-
-    def value(self):
-        return self._value
-
-    def set_value(self, value):
-        self._value = value
-        self._resolved = True
-
-    def resolved(self):
-        return self._resolved
-
-    def incoming(self):
-        return self._incoming
-
-    def add_incoming(self, gene):
-        self._incoming.append(gene)
-
 class Network:
-    def __init__(self, input, output, genes=[]):
+    def __init__(self, input, output, genes=None):
         self._fitness = 0
-        self._genes = genes
+        if callable(genes):
+            # genes of a lazily loaded network, decoded on first use
+            self._load_genes = genes
+        else:
+            self._genes = Genome() if genes is None else genes
         self._input = input
         self._output = output
         self._mutation_rate = {
@@ -74,9 +22,32 @@ class Network:
             'DISABLE': 0.4,
         }
         self._max_neurons = input + output
-        self._neurons = {}
+        # seed of the plan biases, the global numpy state is used without one
+        self._seed = None
+        self._plan = None
+        # bumped by structural changes; genes edited in place since the plan
+        # was built, None meaning all of them
+        self._version = 0
+        self._edited = set()
+        self._innovations = None
+        # link set and non-input gene ends, built on the first structural mutation
+        self._links = None
+        self._ends = None
         self._ranking = 0
 
+    def __getattr__(self, name):
+        # only called for missing attributes: genes not decoded yet
+        if name == '_genes' and '_load_genes' in self.__dict__:
+            self._genes = self.__dict__.pop('_load_genes')()
+            return self._genes
+
+        raise AttributeError(name)
+
+    def __getstate__(self):
+        # a lazily loaded network can not be pickled before it is decoded
+        self._genes
+        return self.__dict__
+
     @staticmethod
     def from_json(obj):
         '''
@@ -88,21 +59,22 @@ class Network:
             'mutation_rate': self._mutation_rate,
             'max_neurons': self._max_neurons,
             'ranking': self._ranking
-            'neurons': {},
         }
         '''
 
-        network = Network(obj['input'], obj['output'], [])
-        network._fitness = obj['fitness']
-        network._mutation_rate = obj['mutation_rate']
-        network._max_neurons = obj['max_neurons']
-        network._ranking = obj['ranking']
-
-        for gene in obj['genes']:
-            network._genes.append(Gene.from_json(gene))
+        # older saves also carry a 'neurons' dump, it is rebuilt by generate()
+        return Network.restore(obj['input'], obj['output'], Genome.from_json(obj['genes']), obj['fitness'],
+                               obj['mutation_rate'], obj['max_neurons'], obj['ranking'], obj.get('seed'))
 
-        for i, neuron in obj['neurons'].items():
-            network._neurons[i] = Neuron.from_json(neuron)
+    @staticmethod
+    def restore(input, output, genes, fitness, mutation_rate, max_neurons, ranking, seed=None):
+        '''network from saved fields, genes is a Genome or a function returning it when first used'''
+        network = Network(input, output, genes)
+        network._fitness = fitness
+        network._mutation_rate = mutation_rate
+        network._max_neurons = max_neurons
+        network._ranking = ranking
+        network._seed = seed
 
         return network
 
@@ -117,134 +89,201 @@ class Network:
     def to_json(self):
         obj = {
             'fitness': self._fitness,
-            'genes': [],
+            'genes': self._genes.to_json(),
             'input': self._input,
             'output': self._output,
             'mutation_rate': self._mutation_rate,
             'max_neurons': self._max_neurons,
             'ranking': self._ranking,
-            'neurons': {},
+            'seed': self._seed,
         }
 
-        #print(len(self._genes))
-        for gene in self._genes:
-            obj['genes'].append(gene.to_json())
-
-        for i, neuron in self._neurons.items():
-            obj['neurons'][i] = neuron.to_json()
-
         return obj
 
     @staticmethod
     def create_basic(input_len, output_len):
-        network = Network(input=input_len, output=output_len, genes=[])
+        network = Network(input=input_len, output=output_len)
 
         # for out in range(output_len):
         #     for into in range(input_len):
         #         if np.random.rand() < 0.5:
-        #             gene = Gene.create(into, out)
-        #             network._genes.append(gene)
+        #             network._genes.add(into, out, np.random.rand() * 4 - 2, True, registry.link(into, out))
 
         return network
 
     @staticmethod
     def copy(network):
-        new_gene = []
-        for gene in network._genes:
-            new_gene.append(Gene.copy(gene, new=False))
-
-        new = Network(input=network._input, output=network._output, genes=new_gene)
+        new = Network(input=network._input, output=network._output, genes=network._genes.copy())
         new._mutation_rate = network._mutation_rate.copy()
         new._max_neurons = network._max_neurons
 
         return new
 
     @staticmethod
-    def crossover(mom, dad):
+    def crossover(mom, dad, rng):
+        return Network.crossover_all([mom], [dad], rng)[0]
+
+    @staticmethod
+    def crossover_all(moms, dads, rng):
+        '''
+        child of every (mom, dad) pair: the fitter parent's genes, matching
+        genes from a random parent when both are as fit, plus half of the
+        other parent's own genes in that case
+
+        Genes of all pairs are matched at once on (pair, innovation) keys and
+        each kind of random number is drawn for the whole batch in one call.
+        '''
         # ensure mom has higher fitness
-        if mom.fitness() < dad.fitness():
-            t = mom
-            mom = dad
-            dad = t
-
-        mom_genes = mom.genes()
-        dad_genes = dad.genes()
-
-        dad_inn = {}
-        for gene in dad_genes:
-            dad_inn[gene.innovation()] = gene
-
-        child_genes = []
-
-        for mom_gene in mom_genes:
-            # same innovation
-            if mom_gene.innovation() in dad_inn:
-                dad_gene = dad_inn[mom_gene.innovation()]
-
-                # same fitness -> random parent
-                if mom.fitness() == dad.fitness():
-                    if np.random.rand() < 0.5:
-                        child_gene = Gene.copy(mom_gene, new=False)
-                    else:
-                        child_gene = Gene.copy(dad_gene, new=False)
-                # fitter parent = mom
-                else:
-                    child_gene = Gene.copy(mom_gene, new=False)
-
-                if not mom_gene.enabled() or not dad_gene.enabled():
-                    if np.random.rand() < 0.75:
-                        child_gene.set_enable(False)
-
-                child_genes.append(child_gene)
-            # disjoints or excess
-            else:
-                child_genes.append(Gene.copy(mom_gene, new=False))
-
-        if mom.fitness() == dad.fitness():
-            mom_inn = {}
-            for gene in mom_genes:
-                mom_inn[gene.innovation()] = gene
-
-            for dad_gene in dad_genes:
-                if dad_gene.innovation() not in mom_inn:
-                    if np.random.rand() < 0.5:
-                        child_genes.append(Gene.copy(dad_gene, new=False))
-
-        child = Network(input=mom._input, output=mom._output, genes=child_genes)
-        child._max_neurons = max(mom._max_neurons, dad._max_neurons)
-
-        return child
+        pairs = [(dad, mom) if mom.fitness() < dad.fitness() else (mom, dad) for mom, dad in zip(moms, dads)]
+        moms, dads = [mom for mom, _ in pairs], [dad for _, dad in pairs]
+        same_fitness = np.array([mom.fitness() == dad.fitness() for mom, dad in zip(moms, dads)], dtype=bool)
+
+        mom_genes, mom_pair = Genome.concatenate([mom.genes() for mom in moms])
+        dad_genes, dad_pair = Genome.concatenate([dad.genes() for dad in dads])
+
+        # innovations are unique keys once offset by their pair
+        low = min(np.min(mom_genes.innovation(), initial=0), np.min(dad_genes.innovation(), initial=0))
+        span = max(np.max(mom_genes.innovation(), initial=0), np.max(dad_genes.innovation(), initial=0)) - low + 1
+        mom_key = mom_pair * span + (mom_genes.innovation() - low)
+        dad_key = dad_pair * span + (dad_genes.innovation() - low)
+
+        # position of every mom gene's innovation among dad's genes
+        matched = np.zeros(len(mom_key), dtype=bool)
+        dad_idx = np.zeros(len(mom_key), dtype=np.int64)
+
+        if len(dad_key) > 0:
+            dad_order = np.argsort(dad_key, kind='stable')
+            pos = np.minimum(np.searchsorted(dad_key[dad_order], mom_key), len(dad_key) - 1)
+            dad_idx = dad_order[pos]
+            matched = dad_key[dad_idx] == mom_key
+
+        # start from mom, she is the fitter parent
+        child_genes = mom_genes.copy()
+        m, d = np.flatnonzero(matched), dad_idx[matched]
+
+        # same innovation, same fitness -> random parent
+        from_dad = (rng.random(len(m)) >= 0.5) & same_fitness[mom_pair[m]]
+        m_dad, d_dad = m[from_dad], d[from_dad]
+        child_genes.into()[m_dad] = dad_genes.into()[d_dad]
+        child_genes.out()[m_dad] = dad_genes.out()[d_dad]
+        child_genes.w()[m_dad] = dad_genes.w()[d_dad]
+        child_genes.enabled()[m_dad] = dad_genes.enabled()[d_dad]
+
+        disabled = ~mom_genes.enabled()[m] | ~dad_genes.enabled()[d]
+        disable = disabled & (rng.random(len(m)) < 0.75)
+        child_genes.enabled()[m[disable]] = False
+
+        # disjoints or excess of dad
+        dad_only = ~np.isin(dad_key, mom_key)
+        take = dad_only & same_fitness[dad_pair] & (rng.random(len(dad_key)) < 0.5)
+        child_genes.extend(dad_genes, take)
+
+        # mom's genes then dad's of each pair, split back into one genome per child
+        owner = np.concatenate((mom_pair, dad_pair[take]))
+        order = np.argsort(owner, kind='stable')
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(owner, minlength=len(moms))))).tolist()
+        child_genes = child_genes.take(order)
+
+        children = []
+        for k, (mom, dad) in enumerate(zip(moms, dads)):
+            child = Network(input=mom._input, output=mom._output,
+                            genes=child_genes.take(slice(offsets[k], offsets[k + 1])))
+            child._max_neurons = max(mom._max_neurons, dad._max_neurons)
+            children.append(child)
+
+        return children
+
+    @staticmethod
+    def breed_all(moms, dads, rng, registry):
+        '''mutated children of (mom, dad) pairs, a None dad makes a copy of mom'''
+        crossed = [i for i, dad in enumerate(dads) if dad is not None]
+        children = [None if dad is not None else Network.copy(mom) for mom, dad in zip(moms, dads)]
+
+        for i, child in zip(crossed, Network.crossover_all([moms[i] for i in crossed], [dads[i] for i in crossed], rng)):
+            children[i] = child
+
+        Network.mutate_all(children, rng, registry)
+        return children
 
     def generate(self):
-        in_len = self._input
-        out_len = self._output
-        self._neurons = {}
+        '''
+        build the evaluation plan, or reuse the cached one when the structure
+        did not change since: weight and single enable edits are patched in
+        place and the plan starts over from its cold steps
+        '''
+        plan = self._plan
+        if plan is None or plan.version() != self._version or not plan.patch(self._genes, self._edited):
+            rng = None if self._seed is None else np.random.default_rng(self._seed)
+            self._plan = Plan(self._input, self._output, self._genes, self._version, rng)
 
-        # input neurons
-        for i in range(in_len):
-            self._neurons[i] = Neuron()
+        self._edited = set()
 
-        # output neurons
-        for i in range(in_len, in_len + out_len):
-            self._neurons[i] = Neuron()
+    def plan(self):
+        return self._plan
 
-        for gene in self._genes:
-            if gene.enabled():
-                if gene.out() not in self._neurons:
-                    self._neurons[gene.out()] = Neuron()
+    def _index(self):
+        if self._links is None:
+            into, out = self._genes.into(), self._genes.out()
+            self._links = set(zip(into.tolist(), out.tolist()))
+
+            ends = np.stack((into, out), axis=1).ravel()
+            self._ends = ends[ends >= self._input].tolist()
+
+    def _edit(self, genes=None):
+        '''record genes (all by default) edited in place for the next generate()'''
+        if genes is None or self._edited is None:
+            self._edited = None
+        else:
+            self._edited.update(genes)
 
-                self._neurons[gene.out()].add_incoming(gene)
+    def _add_gene(self, into, out, w, innovation):
+        self._genes.add(into, out, w, True, innovation)
+        self._innovations = None
+        self._version += 1
 
-                if gene.into() not in self._neurons:
-                    self._neurons[gene.into()] = Neuron()
+        if self._links is not None:
+            self._links.add((into, out))
 
+            if into >= self._input:
+                self._ends.append(into)
+
+            if out >= self._input:
+                self._ends.append(out)
 
     def _gene_exists(self, into, out):
-        for gene in self._genes:
-            if gene.link() == (into, out):
-                return True
+        self._index()
+        return (into, out) in self._links
 
-        return False
+    def innovation_arrays(self):
+        '''innovation numbers in ascending order and the weights of those genes'''
+        if self._innovations is None:
+            order = np.argsort(self._genes.innovation(), kind='stable')
+            self._innovations = (self._genes.innovation()[order], self._genes.w()[order])
+
+        return self._innovations
+
+    def invalidate(self):
+        '''forget everything derived from the genes after they were edited in place'''
+        self._innovations = None
+        self._links = None
+        self._ends = None
+        self._version += 1
+
+    def seed(self):
+        return self._seed
+
+    def set_seed(self, seed):
+        self._seed = seed
+        self._plan = None
+
+    def mutation_rate(self):
+        return self._mutation_rate
+
+    def max_neurons(self):
+        return self._max_neurons
+
+    def set_max_neurons(self, max_neurons):
+        self._max_neurons = max_neurons
 
     def fitness(self):
         return self._fitness
@@ -261,149 +300,144 @@ class Network:
     def set_ranking(self, rank):
         self._ranking = rank
 
-    def _random_neuron(self, non_input=False):
-        candidates = []
+    def _random_neuron(self, u, non_input=False):
+        '''
+        candidate neuron picked by a uniform number u in [0, 1)
+
+        Candidates are the inputs (unless non_input), the outputs, then both
+        ends of every gene in gene order, so neurons used by many genes are
+        more likely. Only the index is computed, nothing is built per call.
+        '''
+        self._index()
         in_len = self._input
         out_len = self._output
 
-        if not non_input:
-            for i in range(in_len):
-                candidates.append(i)
-
-        for i in range(in_len, in_len + out_len):
-            candidates.append(i)
+        if non_input:
+            i = int(u * (out_len + len(self._ends)))
+            return in_len + i if i < out_len else self._ends[i - out_len]
 
-        for gene in self._genes:
-            if not non_input or gene.into() >= in_len:
-                candidates.append(gene.into())
+        i = int(u * (in_len + out_len + 2 * len(self._genes)))
+        if i < in_len + out_len:
+            return i
 
-            if not non_input or gene.out() >= in_len:
-                candidates.append(gene.out())
-
-        return candidates[np.random.randint(len(candidates))]
+        i -= in_len + out_len
+        ends = self._genes.into() if i % 2 == 0 else self._genes.out()
+        return int(ends[i // 2])
 
     # change gene weight
-    def mutate_weight(self, perturb_prob):
-        for gene in self._genes:
-            if np.random.rand() < perturb_prob:
-                new_w = gene.w() + np.random.rand() * self._mutation_rate['PERTURB_BIAS'] * (-1 if np.random.rand() < 0.5 else 1)
-                gene.set_w(new_w)
-            else:
-                gene.set_w(np.random.rand() * 4 - 2)
+    def mutate_weight(self, perturb_prob, rng):
+        w = self._genes.w()
+        w[:] = _perturb(w, perturb_prob, self._mutation_rate['PERTURB_BIAS'], rng)
+        self._innovations = None
+        self._edit()
 
-    # add a new gene
-    def mutate_gene(self):
-        n1 = self._random_neuron(False)
-        n2 = self._random_neuron(True)
+    # add a new gene, u holds 4 uniform numbers in [0, 1)
+    def mutate_gene(self, u, registry):
+        n1 = self._random_neuron(u[0], False)
+        n2 = self._random_neuron(u[1], True)
 
         # force bias
-        if np.random.rand() < 0.4:
+        if u[2] < 0.4:
             n1 = self._input - 1
 
         if n1 == n2 or self._gene_exists(n1, n2):
             return
 
-        gene = Gene.create(n1, n2)
-        self._genes.append(gene)
+        self._add_gene(n1, n2, u[3] * 4 - 2, registry.link(n1, n2))
 
-    # add new neuron
-    def mutate_neuron(self):
+    # add new neuron, u is a uniform number in [0, 1)
+    def mutate_neuron(self, u, registry):
         if len(self._genes) == 0:
             return
 
-        gene = self._genes[np.random.randint(len(self._genes))]
+        gene = self._genes[int(u * len(self._genes))]
 
         if not gene.enabled():
             return
 
-        self._max_neurons += 1
+        neuron, inn1, inn2 = registry.split(gene.into(), gene.out())
+        self._max_neurons = max(self._max_neurons, neuron)
 
-        g1 = Gene.copy(gene)
-        g1.set_w(1.0)
-        g1.set_out(self._max_neurons)
-        g2 = Gene.copy(gene)
-        g2.set_into(self._max_neurons)
+        into, out, w = gene.into(), gene.out(), gene.w()
+        self._add_gene(into, neuron, 1.0, inn1)
+        self._add_gene(neuron, out, w, inn2)
 
-        self._genes += [g1, g2]
-
-    def mutate_enable(self, enable):
-        candidates = []
-
-        for gene in self._genes:
-            if gene.enabled() != enable:
-                candidates.append(gene)
+    def mutate_enable(self, enable, u):
+        candidates = np.flatnonzero(self._genes.enabled() != enable)
 
         if len(candidates) > 0:
-            candidates[np.random.randint(len(candidates))].set_enable(enable)
-
-    def mutate(self):
-        for key, val in self._mutation_rate.items():
-            if np.random.rand() < 0.5:
-                self._mutation_rate[key] = val * 0.95
-            else:
-                self._mutation_rate[key] = val * 1.05263
+            i = int(candidates[int(u * len(candidates))])
+            self._genes.enabled()[i] = enable
+            self._edit([i])
 
-        if np.random.rand() < self._mutation_rate['MUTATE_WEIGHT']:
-            self.mutate_weight(self._mutation_rate['PERTURB'])
+    def mutate(self, rng, registry):
+        Network.mutate_all([self], rng, registry)
 
-        #if np.random.rand() < self._mutation_rate['MUTATE_GENE']:
-        for _ in range(2):
-            self.mutate_gene()
+    @staticmethod
+    def mutate_all(networks, rng, registry):
+        '''
+        mutate every network, drawing each kind of random number for the whole
+        batch in a single call; weights of all networks are perturbed together
+        '''
+        if len(networks) == 0:
+            return
 
-        if np.random.rand() < self._mutation_rate['MUTATE_NEURON']:
-            self.mutate_neuron()
+        keys = list(networks[0]._mutation_rate)
+        factors = np.where(rng.random((len(networks), len(keys))) < 0.5, 0.95, 1.05263).tolist()
+        gates = rng.random((len(networks), 4)).tolist()
+        # 2 x 4 for the new genes, then new neuron, enable and disable picks
+        picks = rng.random((len(networks), 11)).tolist()
 
-        if np.random.rand() < self._mutation_rate['ENABLE']:
-            self.mutate_enable(True)
+        for network, factor in zip(networks, factors):
+            rate = network._mutation_rate
+            for key, f in zip(keys, factor):
+                rate[key] = rate[key] * f
 
-        if np.random.rand() < self._mutation_rate['DISABLE']:
-            self.mutate_enable(False)
+        # weight mutation of every network whose gate opened, in one go
+        perturbed = [network for network, gate in zip(networks, gates)
+                     if gate[0] < network._mutation_rate['MUTATE_WEIGHT']]
 
-        # print(self._max_neurons, len(self._genes))
+        if len(perturbed) > 0:
+            lengths = [len(network._genes) for network in perturbed]
+            w = np.concatenate([network._genes.w() for network in perturbed])
+            perturb_prob = np.repeat([network._mutation_rate['PERTURB'] for network in perturbed], lengths)
+            perturb_bias = np.repeat([network._mutation_rate['PERTURB_BIAS'] for network in perturbed], lengths)
+            w = _perturb(w, perturb_prob, perturb_bias, rng)
 
-    def evaluate(self, input):
-        in_len = self._input
-        out_len = self._output
-        neurons = self._neurons
+            for network, start, end in zip(perturbed, np.cumsum([0] + lengths), np.cumsum(lengths)):
+                network._genes.w()[:] = w[start:end]
+                network._innovations = None
+                network._edit()
 
-        def resolve_neuron(neuron, visited):
-            sum = 0.0
-            for incoming in neuron.incoming():
-                other = neurons[incoming.into()]
+        for network, gate, pick in zip(networks, gates, picks):
+            rate = network._mutation_rate
 
-                if other.resolved():
-                    other_val = other.value()
-                else:
-                    if other in visited:
-                        other_val = 0.0
-                    else:
-                        other_val = resolve_neuron(other, visited + [neuron])
+            #if np.random.rand() < self._mutation_rate['MUTATE_GENE']:
+            network.mutate_gene(pick[0:4], registry)
+            network.mutate_gene(pick[4:8], registry)
 
-                sum += other_val * incoming.w() + other.bias()
+            if gate[1] < rate['MUTATE_NEURON']:
+                network.mutate_neuron(pick[8], registry)
 
-            if len(neuron.incoming()) > 0:
-                neuron.set_value(sigmoid(sum))
-                return neuron.value()
-            else:
-                return 0.0
+            if gate[2] < rate['ENABLE']:
+                network.mutate_enable(True, pick[9])
 
-        # feed input neurons
-        for i in range(in_len):
-            neurons[i].set_value(input[i])
+            if gate[3] < rate['DISABLE']:
+                network.mutate_enable(False, pick[10])
 
-        max_output, max_value = 0, -9999
-        # recursively resolve output neurons
-        for i in range(in_len, in_len + out_len):
-            val = resolve_neuron(neurons[i], [])
-
-            if val > max_value:
-                max_output, max_value = i, val
+    def evaluate(self, input):
+        return self._plan.evaluate(input)
 
-        # reset all neurons for next evaluation
-        #for _, neuron in neurons.items():
-        #    neuron.reset()
+def _perturb(w, perturb_prob, perturb_bias, rng):
+    '''
+    nudge each weight by up to perturb_bias with probability perturb_prob,
+    otherwise draw a new one in [-2, 2)
+    '''
+    u = rng.random((3, len(w)))
+    sign = np.where(u[2] < 0.5, -1.0, 1.0)
 
-        return max_output - in_len
+    return np.where(u[0] < perturb_prob, w + u[1] * perturb_bias * sign, u[1] * 4 - 2)
 
 from .gene import *
+from .plan import *
 from .util import *
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+
+import numpy as np
+
+# children bred per job, fixed so the result does not depend on the workers
+BREED_CHUNK = 8
+
+def create_pool(workers):
+    return multiprocessing.Pool(workers, initializer=_init_worker)
+
+def _init_worker():
+    # forked workers would otherwise share the parent's numpy random state,
+    # still used by networks without a seed
+    np.random.seed()
+
+def _evaluate(job):
+    fitness_fn, obj, seed = job
+    network = Network.from_json(obj)
+    network.generate()
+    return fitness_fn(network, seed)
+
+def evaluate_networks(fitness_fn, networks, seeds, pool=None, workers=1):
+    '''
+    fitness_fn(network, seed) of every network, in order, with one seed per
+    network for the randomness of its evaluation
+
+    With a pool the networks are shipped as JSON objects and rebuilt in the
+    worker processes, so fitness_fn has to be picklable (module level).
+    '''
+    if pool is None:
+        fitness = []
+        for network, seed in zip(networks, seeds):
+            network.generate()
+            fitness.append(fitness_fn(network, seed))
+
+        return fitness
+
+    jobs = [(fitness_fn, network.to_json(), seed) for network, seed in zip(networks, seeds)]
+    chunksize = max(1, len(jobs) // (workers * 4))
+
+    return pool.map(_evaluate, jobs, chunksize)
+
+def _breed(job):
+    moms, dads, seed, registry = job
+    moms = [Network.from_json(obj) for obj in moms]
+    dads = [None if obj is None else Network.from_json(obj) for obj in dads]
+    children = Network.breed_all(moms, dads, np.random.default_rng(seed), registry)
+
+    return [child.to_json() for child in children], registry
+
+def breed_networks(moms, dads, seeds, registry, pool):
+    '''
+    Network.breed_all() of (mom, dad) pairs on pool, in chunks of
+    BREED_CHUNK pairs with one seed each; structural mutations are numbered
+    through registry in chunk order, so the result only depends on the seeds
+    '''
+    def to_json(networks, chunk):
+        return [None if networks[i] is None else networks[i].to_json() for i in chunk]
+
+    chunks = [range(start, min(start + BREED_CHUNK, len(moms))) for start in range(0, len(moms), BREED_CHUNK)]
+    jobs = [(to_json(moms, chunk), to_json(dads, chunk), seed, registry.fork()) for chunk, seed in zip(chunks, seeds)]
+
+    children = []
+    for objs, local in pool.map(_breed, jobs):
+        networks = [Network.from_json(obj) for obj in objs]
+        registry.merge(local, networks)
+        children += networks
+
+    return children
+
+from .network import *
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+class Plan:
+    '''array-backed evaluation order compiled from a network's genes'''
+    def __init__(self, input, output, genome, version=0, rng=None):
+        self._input = input
+        self._output = output
+        self._version = version
+        self._size = len(genome)
+
+        slots = {}
+        for i in range(input + output):
+            slots[i] = i
+
+        enabled = genome.enabled()
+        into = genome.into().tolist()
+        out = genome.out().tolist()
+
+        # slots: inputs, outputs, then hidden neurons in the order their genes
+        # appear, every gene so toggling one never moves a neuron (and its
+        # bias) to another slot
+        for i in range(len(genome)):
+            if out[i] not in slots:
+                slots[out[i]] = len(slots)
+
+            if into[i] not in slots:
+                slots[into[i]] = len(slots)
+
+        self._slots = slots
+        # always 0.0, read by edges pointing back into the path being resolved
+        self._zero = len(slots)
+        # neuron biases, from the global numpy state without an rng
+        self._bias = (np.random if rng is None else rng).random(len(slots)) - 0.5
+
+        # incoming (source, gene) of every target in gene order; disabled genes
+        # from an input into a neuron that has incoming genes are kept as
+        # placeholders so enabling them again is only a patch
+        incoming = {}
+        for i in np.flatnonzero(enabled).tolist():
+            incoming.setdefault(slots[out[i]], []).append((slots[into[i]], i))
+
+        for i in np.flatnonzero(~enabled & (genome.into() < input)).tolist():
+            target = slots.get(out[i])
+            if target in incoming:
+                incoming[target].append((into[i], i))
+
+        for target in incoming:
+            incoming[target].sort(key=lambda edge: edge[1])
+
+        # the first evaluate() runs the cold steps, resolving neurons
+        # depth-first from every output like the old recursive resolver; that
+        # never reset its neurons, so later calls run the warm steps, which
+        # only recompute the outputs
+        cold = []
+        resolved = [False] * len(slots)
+        for i in range(input):
+            resolved[i] = True
+
+        def resolve(target, visited):
+            edges = []
+            for source, gene in incoming.get(target, []):
+                read = source
+                if not resolved[source]:
+                    if source in visited:
+                        read = self._zero
+                    else:
+                        resolve(source, visited | {target})
+
+                edges.append((read, source, gene))
+
+            if len(edges) > 0:
+                cold.append((target, edges))
+                resolved[target] = True
+
+        for i in range(input, input + output):
+            resolve(i, frozenset())
+
+        warm = []
+        for i in range(input, input + output):
+            if i in incoming:
+                warm.append((i, [(source, source, gene) for source, gene in incoming[i]]))
+
+        # genes sharing a target, to tell whether a toggle empties a neuron
+        self._siblings = {}
+        for edges in incoming.values():
+            genes = [gene for _, gene in edges]
+            for gene in genes:
+                self._siblings[gene] = genes
+
+        self._enabled = enabled.copy()
+        self._cold = self._pack(cold, genome)
+        self._warm = self._pack(warm, genome)
+        self._cold_rows, self._cold_edges = self._rows(self._cold)
+        self._warm_rows, self._warm_edges = self._rows(self._warm)
+
+        self._values = [0.0] * (len(slots) + 1)
+        self._resolved = False
+
+    def _pack(self, steps, genome):
+        # CSR-like: step k writes slot target[k] from edges offset[k]:offset[k + 1],
+        # bias is that of the edge's source, added once per edge
+        target = np.array([t for t, _ in steps], dtype=np.int32)
+        offset = np.zeros(len(steps) + 1, dtype=np.int32)
+        source = []
+        owner = []
+        gene = []
+
+        for k, (_, edges) in enumerate(steps):
+            offset[k + 1] = offset[k] + len(edges)
+            for read, real, g in edges:
+                source.append(read)
+                owner.append(real)
+                gene.append(g)
+
+        source = np.array(source, dtype=np.int32)
+        owner = np.array(owner, dtype=np.int32)
+        gene = np.array(gene, dtype=np.int64)
+
+        # placeholders of disabled genes add nothing, recurrent edges read the
+        # zero slot but still add their source's bias
+        on = genome.enabled()[gene]
+        weight = np.where(on, genome.w()[gene], 0.0)
+        bias = np.where(on, self._bias[owner], 0.0)
+
+        return target, offset, source, weight, bias, owner, gene
+
+    @staticmethod
+    def _rows(steps):
+        # plain python rows are the fastest thing to loop over per call,
+        # edges are lists so patches can rewrite them in place
+        target, offset, source, weight, bias = steps[:5]
+        source, weight, bias = source.tolist(), weight.tolist(), bias.tolist()
+        rows = []
+        edges = []
+
+        for k, t in enumerate(target.tolist()):
+            start, end = offset[k], offset[k + 1]
+            row = [[s, w, b] for s, w, b in zip(source[start:end], weight[start:end], bias[start:end])]
+            rows.append((t, row))
+            edges += row
+
+        return tuple(rows), edges
+
+    def input_size(self):
+        return self._input
+
+    def output_size(self):
+        return self._output
+
+    def version(self):
+        return self._version
+
+    def patch(self, genome, genes=None):
+        '''
+        bring weights and enabled flags of genes (all by default) up to date
+        in place and go back to the cold steps
+
+        Returns False when the change needs a new plan: the genome grew, or a
+        toggled gene does not come from an input or would empty its target.
+        '''
+        if len(genome) != self._size:
+            return False
+
+        enabled = genome.enabled()
+        if genes is None:
+            genes = range(self._size)
+
+        changed = []
+        for gene in genes:
+            if enabled[gene] != self._enabled[gene]:
+                siblings = self._siblings.get(gene)
+                if genome.into()[gene] >= self._input or siblings is None or not enabled[siblings].any():
+                    return False
+
+            changed.append(gene)
+
+        if len(changed) > 0:
+            changed = np.array(changed, dtype=np.int64)
+            self._enabled[changed] = enabled[changed]
+
+            for steps, edges in ((self._cold, self._cold_edges), (self._warm, self._warm_edges)):
+                _, _, _, weight, bias, owner, gene = steps
+                at = np.flatnonzero(np.isin(gene, changed))
+                on = enabled[gene[at]]
+                weight[at] = np.where(on, genome.w()[gene[at]], 0.0)
+                bias[at] = np.where(on, self._bias[owner[at]], 0.0)
+
+                for e, w, b in zip(at.tolist(), weight[at].tolist(), bias[at].tolist()):
+                    edges[e][1] = w
+                    edges[e][2] = b
+
+        self.reset()
+        return True
+
+    def num_slots(self):
+        # including the zero slot
+        return self._zero + 1
+
+    def slots(self):
+        return self._slots
+
+    def bias(self):
+        return self._bias
+
+    def cold_steps(self):
+        return self._cold[:5]
+
+    def warm_steps(self):
+        return self._warm[:5]
+
+    def reset(self):
+        values = self._values
+        for i in range(len(values)):
+            values[i] = 0.0
+
+        self._resolved = False
+
+    def evaluate(self, input):
+        in_len = self._input
+        values = self._values
+
+        # feed input neurons
+        for i in range(in_len):
+            values[i] = input[i]
+
+        for target, edges in (self._warm_rows if self._resolved else self._cold_rows):
+            sum = 0.0
+            for source, w, bias in edges:
+                sum += values[source] * w + bias
+
+            values[target] = sigmoid(sum)
+
+        self._resolved = True
+
+        # the first output with the highest value wins
+        max_output, max_value = 0, -9999
+        for i in range(in_len, in_len + self._output):
+            if values[i] > max_value:
+                max_output, max_value = i, values[i]
+
+        return max_output - in_len
+
+from .util import *
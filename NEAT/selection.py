@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+TOURNAMENT_SIZE = 3
+
+def roulette(fitness, count, rng):
+    '''
+    count indices drawn proportionally to fitness shifted by the absolute
+    value of the lowest fitness, one cumulative sum and one searchsorted
+    '''
+    weights = fitness + abs(fitness.min())
+    cumulative = np.cumsum(weights)
+    total = cumulative[-1]
+
+    # nothing to be proportional to, every network is as likely
+    if not total > 0:
+        return rng.integers(len(fitness), size=count)
+
+    picks = np.searchsorted(cumulative, rng.random(count) * total, side='right')
+    return np.minimum(picks, len(fitness) - 1)
+
+def tournament(fitness, count, rng, size=TOURNAMENT_SIZE):
+    '''count winners of tournaments between size random networks'''
+    entrants = rng.integers(len(fitness), size=(count, size))
+    return entrants[np.arange(count), np.argmax(fitness[entrants], axis=1)]
+
+def rank(fitness, count, rng):
+    '''count indices drawn proportionally to their rank, 1 for the lowest fitness'''
+    ranks = np.empty(len(fitness))
+    ranks[np.argsort(fitness, kind='stable')] = np.arange(1, len(fitness) + 1)
+
+    cumulative = np.cumsum(ranks)
+    picks = np.searchsorted(cumulative, rng.random(count) * cumulative[-1], side='right')
+    return np.minimum(picks, len(fitness) - 1)
+
+SCHEMES = {
+    'roulette': roulette,
+    'tournament': tournament,
+    'rank': rank,
+}
+
+def select_parents(scheme, fitness, count, rng):
+    '''
+    (count, 2) indices of mom and dad for count children
+
+    scheme is a name in SCHEMES or a function(fitness, count, rng) returning
+    count indices into fitness.
+    '''
+    if not callable(scheme):
+        scheme = SCHEMES[scheme]
+
+    fitness = np.asarray(fitness, dtype=np.float64)
+    return scheme(fitness, 2 * count, rng).reshape(count, 2)
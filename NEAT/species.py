@@ -1,7 +1,5 @@
 # -*- coding: utf-8 -*-
 
-import numpy as np
-
 CROSSOVER_RATE = 0.75
 
 class Species:
@@ -10,16 +8,42 @@ class Species:
         self._max_fitness = 0
         self._adjust_fitness = 0
         self._stale_count = 0
+        # (innovations, weights, size) of the member new networks are compared with
+        self._representative = None
+        # when the species last took a network, see Neat.add_species_all
+        self._matched = 0
 
     @staticmethod
     def from_json(obj):
+        networks = [Network.from_json(network) for network in obj['networks']]
+        return Species.restore(obj['max_fitness'], obj['adjust_fitness'], obj['stale_count'], networks)
+
+    def __getattr__(self, name):
+        # only called for missing attributes: networks not built yet
+        if name == '_networks' and '_load_networks' in self.__dict__:
+            self._networks = self.__dict__.pop('_load_networks')()
+            return self._networks
+
+        raise AttributeError(name)
+
+    def __getstate__(self):
+        # a lazily loaded species can not be pickled before it is decoded
+        self._networks
+        return self.__dict__
+
+    @staticmethod
+    def restore(max_fitness, adjust_fitness, stale_count, networks):
+        '''species from saved fields, networks is a list or a function returning it when first used'''
         species = Species()
-        species._max_fitness = obj['max_fitness']
-        species._adjust_fitness = obj['adjust_fitness']
-        species._stale_count = obj['stale_count']
+        species._max_fitness = max_fitness
+        species._adjust_fitness = adjust_fitness
+        species._stale_count = stale_count
 
-        for network in obj['networks']:
-            species._networks.append(Network.from_json(network))
+        if callable(networks):
+            del species._networks
+            species._load_networks = networks
+        else:
+            species._networks = list(networks)
 
         return species
 
@@ -36,6 +60,9 @@ class Species:
 
         return obj
 
+    def stale_count(self):
+        return self._stale_count
+
     def add_stale_count(self):
         self._stale_count += 1
         return self._stale_count
@@ -48,12 +75,14 @@ class Species:
         self._stale_count = 0
 
     def max_fitness_now(self):
-        sorted_networks = sorted(self._networks, key=Network.fitness, reverse=True)
-        return sorted_networks[0].fitness()
+        return max(network.fitness() for network in self._networks)
 
     def adjust_fitness(self):
         return self._adjust_fitness;
 
+    def set_adjust_fitness(self, adjust_fitness):
+        self._adjust_fitness = adjust_fitness
+
     def calculate_adjust_fitness(self):
         sum = 0
         for network in self._networks:
@@ -64,18 +93,21 @@ class Species:
 
         return self._adjust_fitness
 
-    def make_child(self):
-        if len(self._networks) > 1 and np.random.rand() < CROSSOVER_RATE:
-            mom = self.fetch_random_network()
-            dad = self.fetch_random_network()
+    def make_child(self, rng, registry):
+        mom, dad = self.pick_parents(1, rng)[0]
+        return Network.breed_all([mom], [dad], rng, registry)[0]
 
-            child = Network.crossover(mom, dad)
-        else:
-            n = self.fetch_random_network()
-            child = Network.copy(n)
+    def pick_parents(self, count, rng):
+        '''
+        (mom, dad) of count children: two random members crossed over with
+        CROSSOVER_RATE, otherwise dad is None and the child copies mom
+        '''
+        n = len(self._networks)
+        cross = (rng.random(count) < CROSSOVER_RATE) & (n > 1)
+        moms = rng.integers(n, size=count).tolist()
+        dads = rng.integers(n, size=count).tolist()
 
-        child.mutate()
-        return child
+        return [(self._networks[m], self._networks[d] if c else None) for m, d, c in zip(moms, dads, cross.tolist())]
 
     def num_networks(self):
         return len(self._networks)
@@ -96,13 +128,39 @@ class Species:
         return rank[:remaining], rank[remaining:]
 
     def add_network(self, network):
+        if self._representative is None:
+            self.choose_representative(network)
+
         self._networks.append(network)
 
-    def fetch_random_network(self):
+    def choose_representative(self, network=None):
+        '''
+        compare new networks with network, the first member by default; its
+        innovation arrays are kept so later edits of its genes do not matter
+        '''
+        if network is None:
+            network = self._networks[0]
+
+        innovations, weights = network.innovation_arrays()
+        self._representative = (innovations, weights, len(network.genes()))
+
+    def representative(self):
+        if self._representative is None and len(self._networks) > 0:
+            self.choose_representative()
+
+        return self._representative
+
+    def matched(self):
+        return self._matched
+
+    def set_matched(self, matched):
+        self._matched = matched
+
+    def fetch_random_network(self, rng):
         n = len(self._networks)
         if n == 0:
             return None
 
-        return self.network(np.random.randint(n))
+        return self.network(int(rng.integers(n)))
 
 from .network import *
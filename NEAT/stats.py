@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import zipfile
+
+import numpy as np
+
+FIELDS = ('generation', 'max', 'mean', 'median', 'species', 'genes')
+
+def generation_stats(generation, species):
+    '''statistics of an evaluated generation, one row of the stats log'''
+    fitness = [network.fitness() for sp in species for network in sp.networks()]
+    genes = [len(network.genes()) for sp in species for network in sp.networks()]
+
+    return {
+        'generation': generation,
+        'max': max(fitness),
+        'mean': float(np.mean(fitness)),
+        'median': float(np.median(fitness)),
+        'species': len(species),
+        'genes': float(np.mean(genes)),
+    }
+
+def append_stats(path, rows):
+    '''append rows to the csv stats log at path, writing its header first if new'''
+    new = not os.path.exists(path)
+    with open(path, 'a') as f:
+        if new:
+            f.write(','.join(FIELDS) + '\n')
+
+        for row in rows:
+            f.write(','.join('' if row.get(key) is None else str(row[key]) for key in FIELDS) + '\n')
+
+def read_stats(path):
+    '''generation -> row of the stats log, missing values are None'''
+    rows = {}
+    if not os.path.exists(path):
+        return rows
+
+    with open(path) as f:
+        next(f)
+        for line in f:
+            values = line.rstrip('\n').split(',')
+            row = {key: (float(v) if v != '' else None) for key, v in zip(FIELDS, values)}
+            row['generation'] = int(row['generation'])
+            rows[row['generation']] = row
+
+    return rows
+
+_FITNESS = re.compile(rb'"fitness":\s*(-?[0-9.eE+-]+)')
+
+def checkpoint_fitness(path, chunk=1 << 20):
+    '''
+    fitness of every network in a checkpoint without building any network:
+    only the fitness column of a .npz is read, a JSON save is scanned in
+    chunks for its "fitness" fields
+    '''
+    if zipfile.is_zipfile(path):
+        with np.load(path) as data:
+            return data['fitness'].tolist()
+
+    fitness = []
+    with open(path, 'rb') as f:
+        rest = b''
+        while True:
+            data = f.read(chunk)
+            buffer = rest + data
+
+            # a field ends at a comma or brace, what follows the last one may
+            # continue in the next chunk
+            cut = len(buffer) if len(data) == 0 else max(buffer.rfind(b','), buffer.rfind(b'}')) + 1
+            fitness += [_number(v) for v in _FITNESS.findall(buffer, 0, cut)]
+
+            if len(data) == 0:
+                return fitness
+
+            rest = buffer[cut:]
+
+def _number(text):
+    return int(text) if text.lstrip(b'-').isdigit() else float(text)
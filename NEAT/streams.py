@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+class RandomStreams:
+    '''
+    every random number of a run, reproducible from one seed
+
+    main() is the generator for what the main process draws in sequence:
+    selection, crossover and mutation. seeds(n) spawns n independent child
+    streams and returns them as plain integer seeds, for things that may run
+    anywhere or in any order (a network's plan biases, a game). The k-th
+    call returns the same seeds for the same root seed.
+
+    to_json() keeps the root seed, how many children were spawned and the
+    state of main(), so a run resumed from a checkpoint continues the same
+    sequence.
+    '''
+    def __init__(self, seed=None):
+        self._seed = np.random.SeedSequence(seed)
+        self._main = np.random.default_rng(self._seed.spawn(1)[0])
+
+    @staticmethod
+    def from_json(obj):
+        streams = RandomStreams.__new__(RandomStreams)
+        streams._seed = np.random.SeedSequence(obj['entropy'], spawn_key=obj['spawn_key'],
+                                               n_children_spawned=obj['children'])
+        streams._main = np.random.default_rng()
+        streams._main.bit_generator.state = obj['main']
+
+        return streams
+
+    def to_json(self):
+        return {
+            'entropy': self._seed.entropy,
+            'spawn_key': list(self._seed.spawn_key),
+            'children': self._seed.n_children_spawned,
+            'main': self._main.bit_generator.state,
+        }
+
+    def main(self):
+        return self._main
+
+    def seeds(self, n):
+        '''n seeds of independent child streams, 63 bit so they fit int64 columns'''
+        return [int(child.generate_state(1, np.uint64)[0] >> np.uint64(1)) for child in self._seed.spawn(n)]
@@ -2,6 +2,8 @@
 
 from math import exp
 
+import numpy as np
+
 # 1, 1, 0.4 - crAIg
 # 2, 2, 0.4 - marI/O
 C1 = 2.0
@@ -11,47 +13,105 @@ C3 = 0.4
 # 1.0 - marI/O
 THRESHOLD = 1.0
 
-def disjoints(genes1, genes2):
-    s1 = set()
-    for gene in genes1:
-        s1.add(gene.innovation())
-
-    s2 = set()
-    for gene in genes2:
-        s2.add(gene.innovation())
-
-    n = max(len(genes1), len(genes2))
-    if n < 20:
-        n = 1
-
-    return len(s1 ^ s2) / n
-
-def weights(genes1, genes2):
-    s1 = {}
-    for gene in genes1:
-        s1[gene.innovation()] = gene.w()
+def distances(network, others):
+    '''
+    distance from network to each of others, computed in one pass over their
+    sorted innovation arrays
+    '''
+    innovations, weights = network.innovation_arrays()
+    return _distances(innovations, weights, len(network.genes()), _pack(others))
+
+def founders(networks, threshold=THRESHOLD):
+    '''
+    species of networks among themselves, in order: each network joins the
+    first earlier founder closer than threshold or founds its own species;
+    returns the index of every network's founder
+
+    Each founder is compared once with all the networks, so this costs one
+    pass over their genes per founder.
+    '''
+    packed = _pack(networks)
+    founder = np.full(len(networks), -1, dtype=np.int64)
+
+    for i, network in enumerate(networks):
+        if founder[i] >= 0:
+            continue
+
+        founder[i] = i
+        innovations, weights = network.innovation_arrays()
+        close = _distances(innovations, weights, len(network.genes()), packed) < threshold
+        close[:i + 1] = False
+        founder[close & (founder < 0)] = i
+
+    return founder
+
+def assign(networks, representatives, threshold=THRESHOLD):
+    '''
+    index of the first of representatives, (innovations, weights, size) as
+    tried in order, each network is closer to than threshold, -1 for none
+
+    A network is not compared again once assigned: the ones left are packed
+    anew when fewer than three quarters of the packed ones remain, and the
+    search stops as soon as none remain.
+    '''
+    match = np.full(len(networks), -1, dtype=np.int64)
+    remaining = np.arange(len(networks))
+    packed_rows = remaining
+    packed = _pack(networks)
+
+    for j, (innovations, weights, size) in enumerate(representatives):
+        if len(remaining) == 0:
+            break
+
+        if 4 * len(remaining) < 3 * len(packed_rows):
+            packed_rows = remaining
+            packed = _pack([networks[i] for i in remaining.tolist()])
+
+        close = packed_rows[_distances(innovations, weights, size, packed) < threshold]
+        match[close[match[close] < 0]] = j
+        remaining = remaining[match[remaining] < 0]
+
+    return match
+
+def _pack(networks):
+    arrays = [network.innovation_arrays() for network in networks]
+    lengths = np.array([len(inn) for inn, _ in arrays], dtype=np.int64)
+    sizes = np.array([len(network.genes()) for network in networks], dtype=np.int64)
+    innovations = np.concatenate([np.zeros(0, dtype=np.int32)] + [inn for inn, _ in arrays])
+    weights = np.concatenate([np.zeros(0)] + [w for _, w in arrays])
+    owner = np.repeat(np.arange(len(networks)), lengths)
+
+    return innovations, weights, owner, lengths, sizes
+
+def _distances(innovations, weights, size, packed):
+    other_innovations, other_weights, owner, lengths, sizes = packed
+    count = len(lengths)
+
+    # genes of the others that the network shares
+    if len(innovations) > 0:
+        pos = np.searchsorted(innovations, other_innovations)
+        pos[pos == len(innovations)] = 0
+        hit = innovations[pos] == other_innovations
+    else:
+        pos = np.zeros(len(other_innovations), dtype=np.int64)
+        hit = np.zeros(len(other_innovations), dtype=bool)
+
+    common = np.bincount(owner[hit], minlength=count)
+    diff = np.bincount(owner[hit], weights=np.abs(other_weights[hit] - weights[pos[hit]]), minlength=count)
 
-    sum = 0
-    n = 0
-    for gene in genes2:
-        if gene.innovation() in s1:
-            sum += abs(gene.w() - s1[gene.innovation()])
-            n += 1
-
-    if n == 0:
-        n = 1
-
-    return sum / n
-
-def distance(genes1, genes2):
     # we set C1 = C2, so no need to calculate excess separately
-    D = disjoints(genes1, genes2)
-    W = weights(genes1, genes2)
+    n = np.maximum(size, sizes)
+    n[n < 20] = 1
+    D = (len(innovations) + lengths - 2 * common) / n
+    W = diff / np.maximum(common, 1)
 
     return (C1 * D) + (C3 * W)
 
+def distance(network1, network2):
+    return distances(network1, [network2])[0]
+
 def is_same_species(network1, network2):
-    d = distance(network1.genes(), network2.genes())
+    d = distance(network1, network2)
     #print(d)
     return d < THRESHOLD
 
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+from functools import lru_cache
+
+import numpy as np
+
+class Encoder:
+    """turns a game into the input of a network"""
+    @staticmethod
+    def from_json(obj):
+        """the encoder described by obj, ClassicEncoder for None (older saves)"""
+        if obj is None:
+            return ClassicEncoder()
+
+        params = {key: value for key, value in obj.items() if key != 'name'}
+        return ENCODERS[obj['name']](**params)
+
+    def to_json(self):
+        """name in ENCODERS and parameters, kept in checkpoints"""
+        raise NotImplementedError
+
+    def input_size(self):
+        """what Neat has to be built with"""
+        raise NotImplementedError
+
+    def padding(self):
+        """cells read past the board around the head, the envs pad their board with as many walls"""
+        return 1
+
+    def encode(self, env):
+        """observation of a SnakeEnv"""
+        raise NotImplementedError
+
+    def encode_batch(self, env, games):
+        """observations of some games of a BatchSnakeEnv, a row each"""
+        raise NotImplementedError
+
+class ClassicEncoder(Encoder):
+    """
+    the Tk game's input: 3x3 sight around the cell in front of the head,
+    which side of the snake the food is on and a bias
+    """
+    def to_json(self):
+        return {'name': 'classic'}
+
+    def input_size(self):
+        return INPUT_SIZE
+
+    def padding(self):
+        return 2
+
+    def encode(self, env):
+        tables = _geometry(env.width(), env.pad())
+        cells = env.cells()
+        head = env.head_cell()
+        direction = env.direction()
+        center = head + tables.offsets[direction]
+        values = []
+
+        for offset in tables.sight:
+            values += SIGHT_VALUES[cells[center + offset]]
+
+        values.append(_side(tables, head, env.food_cell(), tables.right[direction]))
+        # bias
+        values.append(1)
+
+        # the network only ever reads the first INPUT_SIZE values
+        return values[:INPUT_SIZE]
+
+    def encode_batch(self, env, games):
+        tables = _geometry(env.width(), env.pad())
+        n = len(games)
+        head = env.head_cells()[games]
+        direction = env.directions()[games]
+        center = head + tables.offset_array[direction]
+        sight = env.cells()[games[:, None], center[:, None] + tables.sight_array]
+
+        # body cells take two slots, the second one is 0
+        width = 1 + (sight == BODY)
+        start = np.cumsum(width, axis=1) - width
+        values = np.zeros((n, 2 * len(tables.sight) + 2), dtype=np.int64)
+        rows = np.arange(n)
+        values[rows[:, None], start] = SIGHT_FIRST[sight]
+
+        end = start[:, -1] + width[:, -1]
+        values[rows, end] = _food_side(tables, head, env.food_cells()[games], direction)[:, 1]
+        # bias
+        values[rows, end + 1] = 1
+
+        return values[:, :INPUT_SIZE]
+
+class SightEncoder(Encoder):
+    """
+    the (2 radius + 1)^2 cells around the head, turned so the snake always
+    looks up: -1 for a wall or body part, 1 for the food, 0 for nothing;
+    then whether the food is ahead (1) or behind (-1), right (1) or left (-1)
+    and a bias
+    """
+    def __init__(self, radius=2):
+        self._radius = radius
+
+    def to_json(self):
+        return {'name': 'sight', 'radius': self._radius}
+
+    def input_size(self):
+        return (2 * self._radius + 1) ** 2 + 3
+
+    def padding(self):
+        return self._radius
+
+    def encode(self, env):
+        tables = _geometry(env.width(), env.pad())
+        head = env.head_cell()
+        direction = env.direction()
+        cells = np.frombuffer(env.cells(), dtype=np.int8)
+
+        values = CELL_VALUES[cells[head + _square(env.width(), self._radius)[direction]]].tolist()
+        food = env.food_cell()
+        values.append(_side(tables, head, food, tables.ahead[direction]))
+        values.append(_side(tables, head, food, tables.right[direction]))
+        # bias
+        values.append(1)
+
+        return values
+
+    def encode_batch(self, env, games):
+        tables = _geometry(env.width(), env.pad())
+        head = env.head_cells()[games]
+        direction = env.directions()[games]
+        square = _square(env.width(), self._radius)
+
+        sight = CELL_VALUES[env.cells()[games[:, None], head[:, None] + square[direction]]]
+        food = _food_side(tables, head, env.food_cells()[games], direction)
+
+        return np.concatenate([sight, food, np.ones((len(games), 1), dtype=np.int64)], axis=1)
+
+class RayEncoder(Encoder):
+    """
+    along 8 rays from the head, ahead first and then clockwise relative to
+    the snake's heading: 1 / distance to the wall, to the nearest body part
+    and to the food (0 when there is none on the ray), then a bias
+    """
+    def to_json(self):
+        return {'name': 'rays'}
+
+    def input_size(self):
+        return 8 * 3 + 1
+
+    def encode(self, env):
+        rays = _rays(env.width(), env.pad(), env.size())
+        cells = np.frombuffer(env.cells(), dtype=np.int8)
+
+        values = _ray_features(cells[rays[env.direction(), env.head_cell()]]).ravel().tolist()
+        # bias
+        values.append(1.0)
+
+        return values
+
+    def encode_batch(self, env, games):
+        head = env.head_cells()[games]
+        direction = env.directions()[games]
+        rays = _rays(env.width(), env.pad(), env.size())
+
+        seen = env.cells()[games[:, None, None], rays[direction, head]]
+        features = _ray_features(seen).reshape(len(games), -1)
+
+        bias = np.ones((len(games), 1))
+        return np.concatenate([features, bias], axis=1)
+
+ENCODERS = {
+    'classic': ClassicEncoder,
+    'sight': SightEncoder,
+    'rays': RayEncoder,
+}
+
+# tables that only depend on the board's geometry, computed once per board
+# size and shared by every encoder, so a step is a lookup and a gather
+class _Geometry:
+    def __init__(self, width, pad):
+        cells = np.arange(width ** 2)
+        self.x_array = cells % width - pad
+        self.y_array = cells // width - pad
+        self.x = self.x_array.tolist()
+        self.y = self.y_array.tolist()
+
+        # by heading: offset of the next cell, unit vectors ahead and to the right
+        self.offsets = [dx + dy * width for dx, dy in (DIRECTIONS[d] for d in range(4))]
+        self.offset_array = np.array(self.offsets)
+        self.ahead = [DIRECTIONS[d] for d in range(4)]
+        self.right = [(-dy, dx) for dx, dy in self.ahead]
+        self.ahead_array = np.array(self.ahead)
+        self.right_array = np.array(self.right)
+
+        # 3x3 around a cell, column after column
+        self.sight = [ox + oy * width for ox in range(-1, 2) for oy in range(-1, 2)]
+        self.sight_array = np.array(self.sight)
+
+@lru_cache(maxsize=None)
+def _geometry(width, pad):
+    return _Geometry(width, pad)
+
+@lru_cache(maxsize=None)
+def _square(width, radius):
+    """by heading, offsets of the square around the head read row after row from ahead, left to right"""
+    square = np.zeros((4, (2 * radius + 1) ** 2), dtype=np.int64)
+    steps = np.arange(radius, -radius - 1, -1)
+    forward, side = np.repeat(steps, len(steps)), np.tile(-steps, len(steps))
+
+    for d in range(4):
+        (ax, ay), (rx, ry) = DIRECTIONS[d], (-DIRECTIONS[d][1], DIRECTIONS[d][0])
+        square[d] = (forward * ax + side * rx) + (forward * ay + side * ry) * width
+
+    return square
+
+@lru_cache(maxsize=None)
+def _rays(width, pad, size):
+    """
+    [heading, cell, ray, step] cell reached by going step + 1 cells along
+    the ray, rays relative to the heading as in RayEncoder; past the padding
+    they stay on the corner, a wall, so every ray ends on one
+    """
+    x = np.arange(width ** 2) % width
+    y = np.arange(width ** 2) // width
+    steps = np.arange(1, size + 2)
+    rays = np.zeros((4, width ** 2, 8, len(steps)), dtype=np.int64)
+
+    for d in range(4):
+        (ax, ay), (rx, ry) = DIRECTIONS[d], (-DIRECTIONS[d][1], DIRECTIONS[d][0])
+        vectors = [(a * ax + r * rx, a * ay + r * ry)
+                   for a, r in ((1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1))]
+
+        for k, (vx, vy) in enumerate(vectors):
+            px = x[:, None] + vx * steps
+            py = y[:, None] + vy * steps
+            inside = (px >= 0) & (px < width) & (py >= 0) & (py < width)
+            rays[d, :, k] = np.where(inside, px + py * width, 0)
+
+    return rays
+
+def _ray_features(seen):
+    """
+    seen is the (..., ray, step) contents along rays, which run into walls
+    past the board; 1 / distance to the first wall, body part and food of
+    each ray as (..., ray, 3), 0 when there is none
+    """
+    distance = np.arange(1, seen.shape[-1] + 1)
+    features = []
+
+    for content in (WALL, BODY, FOOD):
+        hit = seen == content
+        first = distance[np.argmax(hit, axis=-1)]
+        features.append(np.where(hit.any(axis=-1), 1 / first, 0.0))
+
+    return np.stack(features, axis=-1)
+
+def _side(tables, head, food, axis):
+    """sign of where the food is from the head along axis, a unit vector"""
+    return _sign((tables.x[food] - tables.x[head]) * axis[0] + (tables.y[food] - tables.y[head]) * axis[1])
+
+def _food_side(tables, head, food, direction):
+    """(ahead, right) signs of where the food is from the head, a row per game"""
+    dx = tables.x_array[food] - tables.x_array[head]
+    dy = tables.y_array[food] - tables.y_array[head]
+    ahead = tables.ahead_array[direction]
+    right = tables.right_array[direction]
+
+    return np.stack([np.sign(dx * ahead[:, 0] + dy * ahead[:, 1]), np.sign(dx * right[:, 0] + dy * right[:, 1])], axis=1)
+
+def _sign(v):
+    return (v > 0) - (v < 0)
+
+from .env import *
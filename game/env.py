@@ -0,0 +1,633 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+# the Tk board is 40 graduations of 10px with 20px steps -> 20x20 cells
+GRID_SIZE = 20
+# the snake starts on the cell the Tk version placed its first block on
+START = GRID_SIZE // 2
+
+# 0: up, 1: down, 2: right, 3: left
+DIRECTIONS = {0: (0, -1), 1: (0, 1), 2: (1, 0), 3: (-1, 0)}
+TURN_LEFT = {0: 3, 1: 2, 2: 0, 3: 1}
+TURN_RIGHT = {0: 2, 1: 3, 2: 1, 3: 0}
+
+# network outputs
+LEFT = 0
+STRAIGHT = 1
+RIGHT = 2
+
+# 3x3 sight, food direction and bias
+INPUT_SIZE = 3 * 3 + 2
+OUTPUT_SIZE = 3
+
+FOOD_REWARD = 100
+FITNESS_CUTOFF = -150
+
+EMPTY = 0
+BODY = 1
+FOOD = 2
+WALL = 3
+
+# what a sight cell adds to the observation, the Tk sight still ran the food
+# test after seeing a body part, so body cells take two slots and shift the rest
+SIGHT_VALUES = {EMPTY: (0,), BODY: (-1, 0), FOOD: (1,), WALL: (-1,)}
+
+# the same as tables for BatchSnakeEnv: new direction by [direction, action]
+# and first sight value by cell
+TURNS = np.array([[TURN_LEFT[d], d, TURN_RIGHT[d]] for d in range(4)])
+SIGHT_FIRST = np.array([SIGHT_VALUES[cell][0] for cell in (EMPTY, BODY, FOOD, WALL)])
+# value of a cell for the other encoders: blocked, food or nothing
+CELL_VALUES = np.array([0, -1, 1, -1])
+
+# why a game was cut short, 0 when it was played out
+LOOP = 1
+STALL = 2
+
+# odd multiplier of the rolling hash of a body, its inverse modulo 2 ** 64
+HASH_BASE = 0x9E3779B97F4A7C15
+HASH_INVERSE = pow(HASH_BASE, -1, 1 << 64)
+HASH_MASK = (1 << 64) - 1
+
+class SnakeEnv:
+    """
+    headless snake game with the same rules and fitness shaping as the Tk game,
+    seed is anything np.random.default_rng takes
+    """
+    def __init__(self, size=GRID_SIZE, seed=None, detect_loops=False, food_budget=None, encoder=None):
+        self._size = size
+        self._rng = np.random.default_rng(seed)
+        self._encoder = ClassicEncoder() if encoder is None else encoder
+        # rings of walls around the board, as many as the encoder reads past it
+        self._pad = max(1, self._encoder.padding())
+        self._width = size + 2 * self._pad
+        # padded board, indexed [y + pad, x + pad]
+        self._cells = bytearray(self._width ** 2)
+        self._board = np.frombuffer(self._cells, dtype=np.int8).reshape(self._width, self._width)
+        self._board[:] = WALL
+        self._offsets = {d: dx + dy * self._width for d, (dx, dy) in DIRECTIONS.items()}
+        # cell numbers, tail first, the snake can at most fill the board
+        self._ring = [0] * (size * size)
+        self._tail = 0
+        self._length = 0
+        # cells without a body part and the position of each in _free, -1 if taken
+        self._free = []
+        self._slot = [-1] * len(self._cells)
+        self._food = None
+        self._direction = 0
+        self._fitness = 0
+        self._score = 0
+        self._steps = 0
+        self._done = True
+
+        # keys of a body part, of the food and of a direction for the state
+        # hash, which is only kept up to date when detecting loops
+        self._detect_loops = detect_loops
+        if detect_loops:
+            self._keys, self._food_keys, self._direction_keys = [keys.tolist() for keys in _hash_keys(self._width)]
+        # steps without food before a game is cut short, None for no limit
+        self._food_budget = food_budget
+        # hash of the body, tail first, and HASH_BASE ** length
+        self._hash = 0
+        self._power = 1
+        # a state saved by Brent's cycle detection, the fitness then, steps
+        # since and steps before the next one is saved
+        self._saved = 0
+        self._saved_fitness = 0
+        self._lap = 0
+        self._period = 1
+        self._since_food = 0
+        self._cut = 0
+        self._steps_saved = 0
+
+    def _cell(self, x, y):
+        return (y + self._pad) * self._width + x + self._pad
+
+    def _xy(self, cell):
+        y, x = divmod(cell, self._width)
+        return x - self._pad, y - self._pad
+
+    def reset(self, direction=None):
+        """start a new game and return the first observation"""
+        self.grid()[:] = EMPTY
+        self._free = [self._cell(x, y) for y in range(self._size) for x in range(self._size)]
+        for i, cell in enumerate(self._free):
+            self._slot[cell] = i
+
+        self._tail = 0
+        self._length = 0
+        self._hash = 0
+        self._power = 1
+        self._push(self._cell(START, START))
+        self._place_food()
+
+        if direction is None:
+            direction = int(self._rng.integers(4))
+
+        self._direction = direction
+        self._fitness = 0
+        self._score = 0
+        self._steps = 0
+        self._done = False
+        self._since_food = 0
+        self._cut = 0
+        self._steps_saved = 0
+        if self._detect_loops:
+            self._save_state()
+
+        return self.observation()
+
+    def _push(self, cell):
+        """grow the snake on cell, its new head"""
+        self._ring[(self._tail + self._length) % len(self._ring)] = cell
+        self._length += 1
+        self._cells[cell] = BODY
+        if self._detect_loops:
+            self._hash = (self._hash + self._keys[cell] * self._power) & HASH_MASK
+            self._power = (self._power * HASH_BASE) & HASH_MASK
+
+        # swap the last free cell into its place
+        i = self._slot[cell]
+        last = self._free.pop()
+        if last != cell:
+            self._free[i] = last
+            self._slot[last] = i
+
+        self._slot[cell] = -1
+
+    def _pop(self):
+        """remove the tail"""
+        cell = self._ring[self._tail]
+        self._tail = (self._tail + 1) % len(self._ring)
+        self._length -= 1
+        self._cells[cell] = EMPTY
+        if self._detect_loops:
+            self._hash = ((self._hash - self._keys[cell]) * HASH_INVERSE) & HASH_MASK
+            self._power = (self._power * HASH_INVERSE) & HASH_MASK
+
+        self._slot[cell] = len(self._free)
+        self._free.append(cell)
+
+    def _head(self):
+        return self._ring[(self._tail + self._length - 1) % len(self._ring)]
+
+    # With detect_loops a game ends once its state (body, direction, food)
+    # repeats between two foods. It is taken to go round the same lap again:
+    # if the lap lost fitness it jumps to FITNESS_CUTOFF, where the drift
+    # would have ended it. Networks remember through recurrent links, so a
+    # repeated state is a strong hint of a loop, not a proof.
+    def _state(self):
+        return self._hash ^ self._food_keys[self._food] ^ self._direction_keys[self._direction]
+
+    def _save_state(self, period=1):
+        self._saved = self._state()
+        self._saved_fitness = self._fitness
+        self._lap = 0
+        self._period = period
+
+    def _looped(self):
+        """
+        whether the state repeated since the last food, Brent's way: compare
+        with a saved state, saved anew after 1, 2, 4, ... steps
+        """
+        self._lap += 1
+        if self._state() == self._saved:
+            return True
+
+        if self._lap == self._period:
+            self._save_state(2 * self._period)
+
+        return False
+
+    def _place_food(self):
+        """only put food where there is no snake body part"""
+        self._food = self._free[int(self._rng.integers(len(self._free)))]
+        self._cells[self._food] = FOOD
+
+    def observation(self):
+        return self._encoder.encode(self)
+
+    def step(self, action):
+        """turn left/go straight/turn right and move one cell
+
+        returns (observation, reward, done), observation is None once done
+        """
+        assert not self._done
+
+        if action == LEFT:
+            self._direction = TURN_LEFT[self._direction]
+        elif action == RIGHT:
+            self._direction = TURN_RIGHT[self._direction]
+
+        head = self._head()
+        cell = head + self._offsets[self._direction]
+        self._steps += 1
+
+        content = self._cells[cell]
+        if content == WALL:
+            self._done = True
+            return None, 0, True
+
+        # found food
+        if content == FOOD:
+            self._score += 1
+            self._push(cell)
+            self._fitness += FOOD_REWARD
+
+            # the snake fills the board
+            if len(self._free) == 0:
+                self._done = True
+                return None, FOOD_REWARD, True
+
+            self._place_food()
+            self._since_food = 0
+            if self._detect_loops:
+                self._save_state()
+            return self.observation(), FOOD_REWARD, False
+
+        # hit a body part, the tail has not moved away yet
+        if content == BODY:
+            self._done = True
+            return None, 0, True
+
+        hx, hy = self._xy(head)
+        x, y = self._xy(cell)
+        fx, fy = self._xy(self._food)
+        old_dist = (hx - fx) ** 2 + (hy - fy) ** 2
+        new_dist = (x - fx) ** 2 + (y - fy) ** 2
+
+        # got further from food => penalty
+        if old_dist < new_dist:
+            reward = -2 if self._fitness >= FITNESS_CUTOFF + 2 else -1
+        else:
+            reward = 1
+
+        self._fitness += reward
+
+        self._pop()
+        self._push(cell)
+
+        # too bad fitness
+        if self._fitness <= FITNESS_CUTOFF:
+            self._done = True
+            return None, reward, True
+
+        if self._detect_loops and self._looped():
+            self._cut = LOOP
+            self._done = True
+
+            # every lap loses as much until the fitness cutoff
+            lost = self._saved_fitness - self._fitness
+            if lost > 0:
+                self._steps_saved = -(-(self._fitness - FITNESS_CUTOFF) // lost) * self._lap
+                reward += FITNESS_CUTOFF - self._fitness
+                self._fitness = FITNESS_CUTOFF
+
+            return None, reward, True
+
+        self._since_food += 1
+        if self._food_budget is not None and self._since_food >= self._food_budget:
+            self._cut = STALL
+            self._done = True
+            return None, reward, True
+
+        return self.observation(), reward, False
+
+    def size(self):
+        return self._size
+
+    def grid(self):
+        """the board indexed [y, x], a view of the game's cells"""
+        return self._board[self._pad:-self._pad, self._pad:-self._pad]
+
+    def body(self):
+        """(x, y) of the body parts, tail first"""
+        n = len(self._ring)
+        return [self._xy(self._ring[(self._tail + i) % n]) for i in range(self._length)]
+
+    def head(self):
+        return self._xy(self._head())
+
+    def food(self):
+        return self._xy(self._food)
+
+    def encoder(self):
+        return self._encoder
+
+    def width(self):
+        """side of the padded board"""
+        return self._width
+
+    def pad(self):
+        return self._pad
+
+    def cells(self):
+        """the padded board, cell numbers as in the head_cell() and food_cell()"""
+        return self._cells
+
+    def head_cell(self):
+        return self._head()
+
+    def food_cell(self):
+        return self._food
+
+    def direction(self):
+        return self._direction
+
+    def fitness(self):
+        return self._fitness
+
+    def score(self):
+        return self._score
+
+    def steps(self):
+        return self._steps
+
+    def done(self):
+        return self._done
+
+    def cut(self):
+        return self._cut
+
+    def steps_saved(self):
+        return self._steps_saved
+
+class BatchSnakeEnv:
+    """
+    independent games of SnakeEnv's rules advanced together with NumPy
+    operations, one per seed
+    """
+    def __init__(self, seeds, size=GRID_SIZE, detect_loops=False, food_budget=None, encoder=None):
+        self._size = size
+        self._count = len(seeds)
+        self._rngs = [np.random.default_rng(seed) for seed in seeds]
+        self._encoder = ClassicEncoder() if encoder is None else encoder
+        self._pad = max(1, self._encoder.padding())
+        self._width = size + 2 * self._pad
+        self._all = np.arange(self._count)
+
+        # padded boards, a row per game, cell numbers as in SnakeEnv
+        self._cells = np.full((self._count, self._width ** 2), WALL, dtype=np.int8)
+        self._offsets = np.array([dx + dy * self._width for dx, dy in (DIRECTIONS[d] for d in range(4))])
+        cells = np.arange(self._width ** 2)
+        self._x = cells % self._width - self._pad
+        self._y = cells // self._width - self._pad
+
+        self._ring = np.zeros((self._count, size * size), dtype=np.int64)
+        self._tail = np.zeros(self._count, dtype=np.int64)
+        self._length = np.zeros(self._count, dtype=np.int64)
+        self._head = np.zeros(self._count, dtype=np.int64)
+        self._food = np.zeros(self._count, dtype=np.int64)
+        self._direction = np.zeros(self._count, dtype=np.int64)
+        self._fitness = np.zeros(self._count, dtype=np.int64)
+        self._score = np.zeros(self._count, dtype=np.int64)
+        self._steps = np.zeros(self._count, dtype=np.int64)
+        self._done = np.ones(self._count, dtype=bool)
+
+        # state hashes and Brent's cycle detection as in SnakeEnv
+        self._detect_loops = detect_loops
+        if detect_loops:
+            self._keys, self._food_keys, self._direction_keys = _hash_keys(self._width)
+        self._food_budget = food_budget
+        self._hash = np.zeros(self._count, dtype=np.uint64)
+        self._power = np.ones(self._count, dtype=np.uint64)
+        self._saved = np.zeros(self._count, dtype=np.uint64)
+        self._saved_fitness = np.zeros(self._count, dtype=np.int64)
+        self._lap = np.zeros(self._count, dtype=np.int64)
+        self._period = np.ones(self._count, dtype=np.int64)
+        self._since_food = np.zeros(self._count, dtype=np.int64)
+        self._cut = np.zeros(self._count, dtype=np.int8)
+        self._steps_saved = np.zeros(self._count, dtype=np.int64)
+
+    def _cell(self, x, y):
+        return (y + self._pad) * self._width + x + self._pad
+
+    def reset(self, directions=None):
+        """start every game over and return their first observations"""
+        self.grid()[:] = EMPTY
+        self._tail[:] = 0
+        self._length[:] = 0
+        self._hash[:] = 0
+        self._power[:] = 1
+        self._grow(self._all, np.full(self._count, self._cell(START, START)))
+        self._place_food(self._all)
+
+        if directions is None:
+            directions = [int(rng.integers(4)) for rng in self._rngs]
+
+        self._direction[:] = directions
+        self._fitness[:] = 0
+        self._score[:] = 0
+        self._steps[:] = 0
+        self._done[:] = False
+        self._since_food[:] = 0
+        self._cut[:] = 0
+        self._steps_saved[:] = 0
+        if self._detect_loops:
+            self._save_state(self._all)
+
+        return self._observe(self._all)
+
+    def _place_food(self, games):
+        """only put food where there is no snake body part"""
+        for g in games.tolist():
+            # drawn in board order, so not the food of SnakeEnv with the same seed
+            free = np.flatnonzero(self._cells[g] == EMPTY)
+            self._food[g] = free[self._rngs[g].integers(len(free))]
+
+        self._cells[games, self._food[games]] = FOOD
+
+    def _state(self, games):
+        return self._hash[games] ^ self._food_keys[self._food[games]] ^ self._direction_keys[self._direction[games]]
+
+    def _save_state(self, games, period=1):
+        self._saved[games] = self._state(games)
+        self._saved_fitness[games] = self._fitness[games]
+        self._lap[games] = 0
+        self._period[games] = period
+
+    def _looped(self, games):
+        """which of games repeated a state since their last food, see SnakeEnv._looped()"""
+        self._lap[games] += 1
+        looped = self._state(games) == self._saved[games]
+
+        resave = games[~looped & (self._lap[games] == self._period[games])]
+        self._save_state(resave, 2 * self._period[resave])
+
+        return looped
+
+    def _observe(self, games):
+        return self._encoder.encode_batch(self, games)
+
+    def step(self, actions, games=None):
+        """
+        turn left/go straight/turn right and move one cell in each of games,
+        every game still playing by default
+
+        returns (observations, rewards, done) with a row per game, the
+        observations of games that ended are meaningless
+        """
+        games = np.flatnonzero(~self._done) if games is None else np.asarray(games)
+        assert not self._done[games].any()
+
+        direction = TURNS[self._direction[games], np.asarray(actions)]
+        self._direction[games] = direction
+        head = self._head[games]
+        cell = head + self._offsets[direction]
+        content = self._cells[games, cell]
+        self._steps[games] += 1
+
+        rewards = np.zeros(len(games), dtype=np.int64)
+        done = (content == WALL) | (content == BODY)
+
+        # found food
+        ate = content == FOOD
+        eaters = games[ate]
+        self._grow(eaters, cell[ate])
+        self._score[eaters] += 1
+        self._fitness[eaters] += FOOD_REWARD
+        rewards[ate] = FOOD_REWARD
+
+        # the snake fills the board
+        full = ate.copy()
+        full[ate] = self._length[eaters] == self._size ** 2
+        done |= full
+        self._place_food(games[ate & ~full])
+        self._since_food[eaters] = 0
+        if self._detect_loops:
+            self._save_state(eaters)
+
+        # got further from food => penalty
+        moved = content == EMPTY
+        movers = games[moved]
+        head, cell = head[moved], cell[moved]
+        food = self._food[movers]
+        old_dist = (self._x[head] - self._x[food]) ** 2 + (self._y[head] - self._y[food]) ** 2
+        new_dist = (self._x[cell] - self._x[food]) ** 2 + (self._y[cell] - self._y[food]) ** 2
+        fitness = self._fitness[movers]
+        reward = np.where(old_dist < new_dist, np.where(fitness >= FITNESS_CUTOFF + 2, -2, -1), 1)
+        self._fitness[movers] = fitness + reward
+        rewards[moved] = reward
+
+        tail = self._ring[movers, self._tail[movers]]
+        self._cells[movers, tail] = EMPTY
+        self._tail[movers] = (self._tail[movers] + 1) % self._ring.shape[1]
+        self._length[movers] -= 1
+        if self._detect_loops:
+            self._hash[movers] = (self._hash[movers] - self._keys[tail]) * np.uint64(HASH_INVERSE)
+            self._power[movers] *= np.uint64(HASH_INVERSE)
+        self._grow(movers, cell)
+
+        # too bad fitness
+        done[moved] |= self._fitness[movers] <= FITNESS_CUTOFF
+
+        # positions in games of the ones still going after moving
+        going = np.flatnonzero(moved & ~done)
+        if self._detect_loops:
+            looped = going[self._looped(games[going])]
+            loopers = games[looped]
+            self._cut[loopers] = LOOP
+            done[looped] = True
+
+            # every lap loses as much until the fitness cutoff
+            lost = self._saved_fitness[loopers] - self._fitness[loopers]
+            down, lost = lost > 0, lost[lost > 0]
+            looped, loopers = looped[down], loopers[down]
+            gap = self._fitness[loopers] - FITNESS_CUTOFF
+            self._steps_saved[loopers] = -(-gap // lost) * self._lap[loopers]
+            rewards[looped] -= gap
+            self._fitness[loopers] = FITNESS_CUTOFF
+
+            going = going[~done[going]]
+
+        self._since_food[games[going]] += 1
+        if self._food_budget is not None:
+            stalled = going[self._since_food[games[going]] >= self._food_budget]
+            self._cut[games[stalled]] = STALL
+            done[stalled] = True
+
+        self._done[games] = done
+        return self._observe(games), rewards, done
+
+    def _grow(self, games, cells):
+        """make cells the new heads of games"""
+        self._ring[games, (self._tail[games] + self._length[games]) % self._ring.shape[1]] = cells
+        self._length[games] += 1
+        self._head[games] = cells
+        self._cells[games, cells] = BODY
+        if self._detect_loops:
+            self._hash[games] += self._keys[cells] * self._power[games]
+            self._power[games] *= np.uint64(HASH_BASE)
+
+    def size(self):
+        return self._size
+
+    def count(self):
+        return self._count
+
+    def grid(self):
+        """the boards indexed [game, y, x], a view of the games' cells"""
+        boards = self._cells.reshape(self._count, self._width, self._width)
+        return boards[:, self._pad:-self._pad, self._pad:-self._pad]
+
+    def body(self, game):
+        """(x, y) of the body parts of game, tail first"""
+        n = self._ring.shape[1]
+        cells = self._ring[game, (self._tail[game] + np.arange(self._length[game])) % n]
+        return list(zip(self._x[cells].tolist(), self._y[cells].tolist()))
+
+    def heads(self):
+        return np.stack([self._x[self._head], self._y[self._head]], axis=1)
+
+    def food(self):
+        return np.stack([self._x[self._food], self._y[self._food]], axis=1)
+
+    def encoder(self):
+        return self._encoder
+
+    def width(self):
+        """side of the padded boards"""
+        return self._width
+
+    def pad(self):
+        return self._pad
+
+    def cells(self):
+        """the padded boards, a row per game, cell numbers as in head_cells() and food_cells()"""
+        return self._cells
+
+    def head_cells(self):
+        return self._head
+
+    def food_cells(self):
+        return self._food
+
+    def directions(self):
+        return self._direction
+
+    def fitness(self):
+        return self._fitness
+
+    def scores(self):
+        return self._score
+
+    def steps(self):
+        return self._steps
+
+    def done(self):
+        return self._done
+
+    def cuts(self):
+        return self._cut
+
+    def steps_saved(self):
+        return self._steps_saved
+
+def _hash_keys(width):
+    """random keys of the state hash for each cell of a padded board and each direction, the same for every game"""
+    rng = np.random.default_rng(width)
+    keys = rng.integers(1 << 64, size=(3, width ** 2), dtype=np.uint64)
+
+    return keys[0], keys[1], keys[2, :4]
+
+from .encoders import *
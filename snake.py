@@ -1,7 +1,6 @@
 from tkinter import *
-from random import randint
 from NEAT.neat import *
-from math import sqrt
+from game.env import *
 
 # constants that go in the making of the grid used for the snake's movment
 GRADUATION = 40
@@ -22,20 +21,12 @@ SN_COLOR = 'white'
 SN = 'snake'
 OB = 'obstacle'
 SIZE = {SN: SN_SIZE, OB: OB_SIZE}
-# constants for keyboard input
-UP = 'Up'
-DOWN = 'Down'
-RIGHT = 'Right'
-LEFT = 'Left'
-# a dictionary to ease access to 'directions'
-DIRECTIONS = {0: [0, -1], 1: [0, 1], 2: [1, 0], 3: [-1, 0]}
-AXES = {0: 'Vertical', 1: 'Vertical', 2: 'Horizontal', 3: 'Horizontal'}
-DIRECTION_CONVERT = {0: UP, 1: DOWN, 2: RIGHT, 3: LEFT}
 # refresh time for the perpetual motion
 REFRESH_TIME = 1
 
-def distance(x1, y1, x2, y2):
-    return sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+def pixel(x, y):
+    """canvas coordinates of the center of a grid cell"""
+    return PIXEL * (2 * x + 1), PIXEL * (2 * y + 1)
 
 class Master(Canvas):
     """create the game canvas, the snake, the obstacle, keep track of the score"""
@@ -45,11 +36,13 @@ class Master(Canvas):
         self.running = 0
         self.snake = None
         self.obstacle = None
-        self.direction = None
         self.current = None
         self.score = Scores(boss)
-        self.neat = Neat(input_size=3 * 3 + 2, output_size=3, save_path='./save')
+        self.neat = Neat(input_size=INPUT_SIZE, output_size=OUTPUT_SIZE, save_path='./save',
+                         encoder=ClassicEncoder().to_json())
         self.neat.load()
+        # play the networks on the inputs they were trained with
+        self.env = SnakeEnv(size=GRADUATION // 2, encoder=Encoder.from_json(self.neat.encoder()))
         self.neat.get_graph()
         self.generation = StringVar(self, '0')
         self.species = StringVar(self, '0')
@@ -60,10 +53,10 @@ class Master(Canvas):
     def start(self):
         """start snake game"""
         if self.running == 0:
+            self.env.reset()
             self.snake = Snake(self)
             self.obstacle = Obstacle(self)
-            self.direction = RIGHT
-            self.current = Movement(self, randint(0, 3))
+            self.current = Movement(self)
             self.current.begin()
             self.running = 1
             self.generation.set(self.neat.generation())
@@ -83,71 +76,6 @@ class Master(Canvas):
 
             self.neat.next()
 
-    def redirect(self, event):
-        """taking keyboard inputs and moving the snake accordingly"""
-        if 1 == self.running and \
-                event.keysym in AXES.keys() and\
-                AXES[event.keysym] != AXES[self.direction]:
-            self.current.flag = 0
-            self.direction = event.keysym
-            self.current = Movement(self, event.keysym)  # a new instance at each turn to avoid confusion/tricking
-            self.current.begin()  # program gets tricked if the user presses two arrow keys really quickly
-
-    '''
-        -1: out of map
-        -1: snake body
-        1: empty space
-        2: apple
-    '''
-    # def map(self):
-    #     tile = [1 for _ in range(STEP * STEP)]
-    #
-    #     for block in self.snake.blocks:
-    #         x = (block.x - 10) // STEP
-    #         y = (block.y - 10) // STEP
-    #         tile[y * STEP + x] = -1
-    #
-    #     x = (self.obstacle.x - 10) // STEP
-    #     y = (self.obstacle.y - 10) // STEP
-    #     tile[y * STEP + x] = 2
-    #
-    #     return tile
-
-    # get 3x3 sight around given x, y
-    def sight(self, x, y):
-        sight = []
-
-        for dx in range(-1, 2):
-            for dy in range(-1, 2):
-                xx = x + dx
-                yy = y + dy
-
-                # check if we see wall
-                if xx < 0 or xx >= STEP or yy < 0 or yy >= STEP:
-                    #sight[(dy + 1) * 5 + (dx + 1)] = -1
-                    sight.append(-1)
-                else:
-                    # check if we see snake body
-                    for block in self.snake.blocks:
-                        snake_x = (block.x - 10) // STEP
-                        snake_y = (block.y - 10) // STEP
-
-                        if xx == snake_x and yy == snake_y:
-                            #sight[(dy + 1) * 3 + (dx + 1)] = -1
-                            sight.append(-1)
-                            break
-
-                    # check if we see food
-                    food_x = (self.obstacle.x - 10) // STEP
-                    food_y = (self.obstacle.y - 10) // STEP
-
-                    if xx == food_x and yy == food_y:
-                        #sight[(dy + 1) * 5 + (dx + 1)] = 1
-                        sight.append(1)
-                    else:
-                        sight.append(0)
-
-        return sight
 
 class Scores:
     """Objects that keep track of the score and high score"""
@@ -195,16 +123,9 @@ class Shape:
 
 
 class Obstacle(Shape):
-    """snake food"""
+    """snake food, drawn where the game placed it"""
     def __init__(self, can):
-        """only create the obstacles where there is no snake body part"""
-        self.can = can
-        p = int(GRADUATION/2 - 1)
-        n, m = randint(0, p), randint(0, p)
-        a, b = PIXEL * (2 * n + 1), PIXEL * (2 * m + 1)
-        while [a, b] in [[block.x, block.y] for block in self.can.snake.blocks]:
-            n, m = randint(0, p), randint(0, p)
-            a, b = PIXEL * (2 * n + 1), PIXEL * (2 * m + 1)
+        a, b = pixel(*can.env.food())
         super().__init__(can, a, b, OB)
 
 
@@ -215,149 +136,51 @@ class Block(Shape):
 
 
 class Snake:
-    """a snake keeps track of its body parts"""
+    """a snake keeps track of the drawn body parts of the game's snake"""
     def __init__(self, can):
-        """initial position chosen by me"""
         self.can = can
-        a = PIXEL + 2 * int(GRADUATION/4) * PIXEL
-        self.blocks = [Block(can, a, a)]
-
-    def move(self, path):
-        """an elementary step consisting of putting the tail of the snake in the first position"""
-        old_x = self.blocks[-1].x
-        old_y = self.blocks[-1].y
-        new_x = old_x + STEP * path[0]# % WD
-        new_y = old_y + STEP * path[1]# % HT
-
-        if new_x < 0 or new_x > WD or new_y < 0 or new_y > HT:
-            self.can.clean()
-            self.can.start()
-        elif new_x == self.can.obstacle.x and new_y == self.can.obstacle.y:  # check if we find food
-            self.can.score.increment()
-            self.can.obstacle.delete()
-            self.blocks.append(Block(self.can, new_x, new_y))
-            self.can.obstacle = Obstacle(self.can)
-            # +100 pts for finding food
-            fitness = self.can.neat.add_fitness(100)
-            self.can.fitness.set(fitness)
-            if fitness > int(self.can.max_fitness.get()):
-                self.can.max_fitness.set(fitness)
+        self.blocks = [Block(can, *pixel(x, y)) for x, y in can.env.body()]
+
+    def move(self, grown):
+        """follow the game's head, either growing or putting the tail in the first position"""
+        a, b = pixel(*self.can.env.head())
 
-        elif [new_x, new_y] in [[block.x, block.y] for block in self.blocks]:  # check if we hit a body part
-            self.can.clean()
-            self.can.start()
+        if grown:
+            self.blocks.append(Block(self.can, a, b))
         else:
-            old_dist = distance(old_x, old_y, self.can.obstacle.x, self.can.obstacle.y)
-            new_dist = distance(new_x, new_y, self.can.obstacle.x, self.can.obstacle.y)
+            self.blocks[0].modify(a, b)
+            self.blocks = self.blocks[1:] + [self.blocks[0]]
 
-            c_fitness = self.can.neat.fitness()
 
-            # got further from food => penalty
-            if old_dist < new_dist:
-                if c_fitness >= -148:
-                    fitness = self.can.neat.add_fitness(-2)
-                else:
-                    fitness = self.can.neat.add_fitness(-1)
-            else:
-                fitness = self.can.neat.add_fitness(1)
+class Movement:
+    """object that enters the snake into a perpetual state of motion driven by the network"""
+    def __init__(self, can):
+        self.flag = 1
+        self.can = can
+
+    def begin(self):
+        """start the perpetual motion"""
+        if self.flag > 0:
+            env = self.can.env
+            direction = self.can.neat.evaluate(env.observation())
+            _, reward, done = env.step(direction)
+            fitness = self.can.neat.add_fitness(reward)
 
             self.can.fitness.set(fitness)
             if fitness > int(self.can.max_fitness.get()):
                 self.can.max_fitness.set(fitness)
 
-            # too bad fitness
-            if fitness <= -150:
+            if done:
                 self.can.clean()
                 self.can.start()
+                return
 
-            self.blocks[0].modify(new_x, new_y)
-            self.blocks = self.blocks[1:] + [self.blocks[0]]
-
+            if reward == FOOD_REWARD:
+                self.can.score.increment()
+                self.can.obstacle.delete()
+                self.can.obstacle = Obstacle(self.can)
 
-class Movement:
-    """object that enters the snake into a perpetual state of motion in a predefined direction"""
-    def __init__(self, can, direction):
-        self.flag = 1
-        self.can = can
-        self.direction = direction
-
-    def begin(self):
-        """start the perpetual motion"""
-        if self.flag > 0:
-            #map = self.can.map()
-            dx, dy = DIRECTIONS[self.direction]
-            x = (self.can.snake.blocks[-1].x - 10) // STEP
-            y = (self.can.snake.blocks[-1].y - 10) // STEP
-            sight = self.can.sight(x + dx, y + dy)
-
-            food_x = (self.can.obstacle.x - 10) // STEP
-            food_y = (self.can.obstacle.y - 10) // STEP
-
-            # UP
-            if self.direction == 0:
-                if food_x < x:
-                    sight.append(-1)
-                elif food_x == x:
-                    sight.append(0)
-                else:
-                    sight.append(1)
-            # DOWN
-            elif self.direction == 1:
-                if food_x < x:
-                    sight.append(1)
-                elif food_x == x:
-                    sight.append(0)
-                else:
-                    sight.append(-1)
-            # RIGHT
-            elif self.direction == 2:
-                if food_y < y:
-                    sight.append(-1)
-                elif food_y == y:
-                    sight.append(0)
-                else:
-                    sight.append(1)
-            # LEFT
-            elif self.direction == 3:
-                if food_y < y:
-                    sight.append(1)
-                elif food_y == y:
-                    sight.append(0)
-                else:
-                    sight.append(-1)
-            #sight.append(1 / distance(x, y, food_x, food_y))
-
-            # bias
-            sight.append(1)
-            direction = self.can.neat.evaluate(sight)
-
-            # make left turn
-            if direction == 0:
-                if self.direction == 0:
-                    self.direction = 3
-                elif self.direction == 1:
-                    self.direction = 2
-                elif self.direction == 2:
-                    self.direction = 0
-                elif self.direction == 3:
-                    self.direction = 1
-            # make right turn
-            elif direction == 2:
-                if self.direction == 0:
-                    self.direction = 2
-                elif self.direction == 1:
-                    self.direction = 3
-                elif self.direction == 2:
-                    self.direction = 1
-                elif self.direction == 3:
-                    self.direction = 0
-
-            # if self.direction != direction and \
-            #     direction in AXES.keys() and \
-            #     AXES[direction] != AXES[self.direction]:
-            #     self.direction = direction
-
-            self.can.snake.move(DIRECTIONS[self.direction])
+            self.can.snake.move(reward == FOOD_REWARD)
             self.can.after(REFRESH_TIME, self.begin)
 
     def stop(self):
@@ -368,7 +191,6 @@ root = Tk()
 root.title("Snake Game")
 game = Master(root)
 game.grid(column=1, row=0, rowspan=3)
-#root.bind("<Key>", game.redirect)
 buttons = Frame(root, width=35, height=2*HT/5)
 Button(buttons, text='Start', command=game.start).grid()
 Button(buttons, text='Stop', command=game.clean).grid()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+from functools import partial
+
+from NEAT.neat import *
+from NEAT.selection import SCHEMES
+from game.env import *
+
+# games cut short in this process since the last report, and about how many steps that saved
+cut_short = {'games': 0, 'steps': 0}
+
+def play(neat, **options):
+    """play the episodes of the current network and move on to the next one"""
+    neat.play_episodes(partial(play_networks, **options), [neat.network()])
+    neat.next()
+
+def play_network(network, seed, **options):
+    """fitness of one game played by an already generated network, options go to SnakeEnv"""
+    env = SnakeEnv(seed=seed, **options)
+    observation = env.reset()
+    done = False
+
+    while not done:
+        observation, _, done = env.step(network.evaluate(observation))
+
+    cut_short['games'] += env.cut() != 0
+    cut_short['steps'] += env.steps_saved()
+
+    return env.fitness()
+
+def play_networks(networks, seeds, **options):
+    """fitness of one game of each network, one after the other"""
+    return evaluate_networks(partial(play_network, **options), networks, seeds)
+
+def play_batch(evaluator, seeds, **options):
+    """fitness of one game of each network of evaluator, in lockstep with one batched evaluation per tick"""
+    env = BatchSnakeEnv(seeds, **options)
+    evaluator.reset()
+    observations = env.reset()
+    alive = np.arange(len(seeds))
+
+    while len(alive) > 0:
+        actions = evaluator.evaluate(observations, alive)
+        observations, _, done = env.step(actions, alive)
+        alive = alive[~done]
+        observations = observations[~done]
+
+    cut_short['games'] += int(np.count_nonzero(env.cuts()))
+    cut_short['steps'] += int(env.steps_saved().sum())
+
+    return env.fitness().tolist()
+
+def play_population(neat, **options):
+    """play the episodes of every network without a fitness yet, all games of an episode in lockstep"""
+    neat.play_episodes(lambda networks, seeds: play_batch(neat.population_evaluator(networks), seeds, **options))
+    neat.end_generation()
+
+def main():
+    parser = argparse.ArgumentParser(description='train snake networks without the Tk window')
+    parser.add_argument('--generations', type=int, default=0,
+                        help='number of generations to train, 0 runs forever')
+    parser.add_argument('--save-path', default='./save')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed of the run, resumed runs continue from the checkpoint')
+    parser.add_argument('--batch', action='store_true',
+                        help='play a whole generation in lockstep with batched evaluation')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='play a whole generation on this many processes')
+    parser.add_argument('--compress', action='store_true',
+                        help='compress checkpoints, they can no longer be memory-mapped')
+    parser.add_argument('--keep-last', type=int, default=0,
+                        help='keep only the last N checkpoints (and every --keep-every th), 0 keeps all')
+    parser.add_argument('--keep-every', type=int, default=0)
+    parser.add_argument('--full-every', type=int, default=10,
+                        help='write a full checkpoint every N generations, deltas in between')
+    parser.add_argument('--selection', choices=sorted(SCHEMES), default='roulette',
+                        help='how parents are picked')
+    parser.add_argument('--parallel-offspring', action='store_true',
+                        help='with --workers, also cross over and mutate the children on the workers')
+    parser.add_argument('--episodes', type=int, default=1,
+                        help='games per network, its fitness is their mean; every network plays the same games')
+    parser.add_argument('--max-episode-fitness', type=int, default=None,
+                        help='fitness no game can beat, lets networks that can not become elites stop early '
+                             '(elitist reproduction only)')
+    parser.add_argument('--detect-loops', action='store_true',
+                        help='end a game once its state repeats between two foods')
+    parser.add_argument('--food-budget', type=int, default=None,
+                        help='end a game after this many steps without food')
+    parser.add_argument('--encoder', choices=sorted(ENCODERS), default='classic',
+                        help='what the networks see of the game')
+    parser.add_argument('--sight-radius', type=int, default=2,
+                        help='with --encoder sight, how far around the head the networks see')
+    parser.add_argument('--reproduction', choices=[ELITIST, SPECIES], default=ELITIST,
+                        help='keep the best networks, or breed each species by its shared fitness')
+    args = parser.parse_args()
+
+    if args.max_episode_fitness is not None and args.reproduction != ELITIST:
+        parser.error('--max-episode-fitness only applies to --reproduction {}'.format(ELITIST))
+
+    encoder = SightEncoder(args.sight_radius) if args.encoder == 'sight' else ENCODERS[args.encoder]()
+    neat = Neat(input_size=encoder.input_size(), output_size=OUTPUT_SIZE, save_path=args.save_path,
+                compress=args.compress, keep_last=args.keep_last, keep_every=args.keep_every,
+                full_every=args.full_every, seed=args.seed, selection=args.selection,
+                parallel_offspring=args.parallel_offspring, reproduction=args.reproduction,
+                episodes=args.episodes, episode_bounds=(FITNESS_CUTOFF, args.max_episode_fitness),
+                encoder=encoder.to_json())
+    neat.load()
+
+    trained = Encoder.from_json(neat.encoder()).to_json()
+    if trained != encoder.to_json():
+        parser.error('the networks in {} were trained with encoder {}, not {}'.format(
+            args.save_path, trained, encoder.to_json()))
+
+    options = {'encoder': encoder, 'detect_loops': args.detect_loops, 'food_budget': args.food_budget}
+
+    first = neat.generation()
+    while args.generations == 0 or neat.generation() - first < args.generations:
+        generation = neat.generation()
+        if args.workers > 0:
+            neat.evaluate_generation(partial(play_network, **options), workers=args.workers)
+        elif args.batch:
+            play_population(neat, **options)
+        else:
+            play(neat, **options)
+
+        if neat.generation() != generation:
+            # games played on workers are not counted
+            if cut_short['games'] > 0:
+                print('generation', neat.generation(), '({games} games cut short, about {steps} steps saved)'.format(**cut_short))
+            else:
+                print('generation', neat.generation())
+
+            cut_short['games'] = cut_short['steps'] = 0
+
+    neat.close()
+
+if __name__ == '__main__':
+    main()